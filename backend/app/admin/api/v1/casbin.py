@@ -1,9 +1,10 @@
 from typing import Annotated
 from uuid import UUID
 
-from fastapi import APIRouter, Query, Request
+from fastapi import APIRouter, Body, Query, Request
 
 from backend.app.admin.schema.casbin_rule import (
+    CheckPolicyParam,
     CreatePolicyParam,
     CreateUserRoleParam,
     DeleteAllPoliciesParam,
@@ -17,6 +18,7 @@ from backend.common.pagination import DependsPagination, paging_data
 from backend.common.response.response_schema import ResponseModel, response_base
 from backend.common.security.jwt import DependsJwtAuth
 from backend.common.security.rbac import DependsRBAC
+from backend.core.conf import settings
 from backend.database.db_postgres import CurrentSession
 
 router = APIRouter(prefix='/casbin', tags=["Casbin"])
@@ -46,6 +48,18 @@ async def get_all_policies(request: Request, role: Annotated[int | None, Query(d
     return response_base.success(request=request, data=policies)
 
 
+@router.post('/check', summary='Check permissions of the current user in batch', dependencies=[DependsJwtAuth])
+async def check_policies(
+    request: Request,
+    ps: Annotated[list[CheckPolicyParam], Body(max_length=settings.RBAC_CHECK_MAX_POLICIES)],
+) -> ResponseModel:
+    """
+    Returns allow / deny for each (method, path) pair, using the same rules as the RBAC dependency
+    """
+    data = await casbin_service.check_policies(request=request, ps=ps)
+    return response_base.success(request=request, data=data)
+
+
 @router.post(
     '/policy',
     summary='Add P permission policy',
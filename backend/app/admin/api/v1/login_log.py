@@ -4,11 +4,13 @@ from fastapi import APIRouter, Query, Request
 
 from backend.app.admin.schema.login_log import GetLoginLogListDetails
 from backend.app.admin.service.login_log_service import login_log_service
-from backend.common.pagination import DependsPagination, paging_data
+from backend.common.enums import CountStrategy
+from backend.common.pagination import CursorParams, DependsPagination, cursor_paging_data, paging_data
 from backend.common.response.response_schema import ResponseModel, response_base
 from backend.common.security.jwt import DependsJwtAuth
 from backend.common.security.rbac import DependsRBAC
 from backend.database.db_postgres import CurrentSession
+from backend.models import LoginLog
 
 router = APIRouter(prefix="/login_log", tags=["Login log"] )
 
@@ -29,7 +31,33 @@ async def get_pagination_login_logs(
     ip: Annotated[str | None, Query()] = None,
 ) -> ResponseModel:
     log_select = await login_log_service.get_select(username=username, status=status, ip=ip)
-    page_data = await paging_data(db, log_select, GetLoginLogListDetails)
+    page_data = await paging_data(db, log_select, GetLoginLogListDetails, count_strategy=CountStrategy.cached)
+    return response_base.success(request=request, data=page_data)
+
+
+@router.get(
+    '/cursor',
+    summary='(Fuzzy Condition) Cursor Paging for Login Logs',
+    dependencies=[DependsJwtAuth],
+)
+async def get_cursor_pagination_login_logs(
+    request: Request,
+    db: CurrentSession,
+    params: CursorParams,
+    username: Annotated[str | None, Query()] = None,
+    status: Annotated[int | None, Query()] = None,
+    ip: Annotated[str | None, Query()] = None,
+) -> ResponseModel:
+    log_select = await login_log_service.get_select(username=username, status=status, ip=ip)
+    page_data = await cursor_paging_data(
+        db,
+        log_select,
+        GetLoginLogListDetails,
+        request=request,
+        params=params,
+        order_column=LoginLog.login_time,
+        id_column=LoginLog.id,
+    )
     return response_base.success(request=request, data=page_data)
 
 
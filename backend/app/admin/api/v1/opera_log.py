@@ -4,11 +4,13 @@ from fastapi import APIRouter, Query, Request
 
 from backend.app.admin.schema.opera_log import GetOperaLogListDetails
 from backend.app.admin.service.opera_log_service import opera_log_service
-from backend.common.pagination import DependsPagination, paging_data
+from backend.common.enums import CountStrategy
+from backend.common.pagination import CursorParams, DependsPagination, cursor_paging_data, paging_data
 from backend.common.response.response_schema import ResponseModel, response_base
 from backend.common.security.jwt import DependsJwtAuth
 from backend.common.security.rbac import DependsRBAC
 from backend.database.db_postgres import CurrentSession
+from backend.models import OperaLog
 
 router = APIRouter(prefix="/opera_log", tags=["Operation Log"])
 
@@ -29,7 +31,33 @@ async def get_pagination_opera_logs(
     ip: Annotated[str | None, Query()] = None,
 ) -> ResponseModel:
     log_select = await opera_log_service.get_select(username=username, status=status, ip=ip)
-    page_data = await paging_data(db, log_select, GetOperaLogListDetails)
+    page_data = await paging_data(db, log_select, GetOperaLogListDetails, count_strategy=CountStrategy.estimated)
+    return response_base.success(request=request, data=page_data)
+
+
+@router.get(
+    '/cursor',
+    summary='(Fuzzy Condition) Cursor Paging for Operation Logs',
+    dependencies=[DependsJwtAuth],
+)
+async def get_cursor_pagination_opera_logs(
+    request: Request,
+    db: CurrentSession,
+    params: CursorParams,
+    username: Annotated[str | None, Query()] = None,
+    status: Annotated[int | None, Query()] = None,
+    ip: Annotated[str | None, Query()] = None,
+) -> ResponseModel:
+    log_select = await opera_log_service.get_select(username=username, status=status, ip=ip)
+    page_data = await cursor_paging_data(
+        db,
+        log_select,
+        GetOperaLogListDetails,
+        request=request,
+        params=params,
+        order_column=OperaLog.opera_time,
+        id_column=OperaLog.id,
+    )
     return response_base.success(request=request, data=page_data)
 
 
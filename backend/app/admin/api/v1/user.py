@@ -1,8 +1,9 @@
 from typing import Annotated, Union
 from fastapi import APIRouter, Path, Query, Request
 from backend.common.enums import Role
-from backend.common.pagination import DependsPagination, paging_data
+from backend.common.pagination import CursorParams, DependsPagination, cursor_paging_data, paging_data
 from backend.database.db_postgres import CurrentSession
+from backend.models import User
 from backend.utils.serializers import select_as_dict
 
 from backend.app.admin.schema.user import GetUserInfoListDetails, UserUpdate
@@ -45,3 +46,31 @@ async def get_pagination_users(
     page_data = await paging_data(db, user_select, GetUserInfoListDetails)
     return response_base.success(request=request, data=page_data)
 
+
+@router.get(
+    "/cursor",
+    summary="Get users cursor pagination",
+    dependencies=[DependsJwtAuth],
+)
+async def get_cursor_pagination_users(
+    request: Request,
+    db: CurrentSession,
+    params: CursorParams,
+    query: Annotated[str | None, Query()] = None,
+    role: Annotated[Union[Role, str] | None, Query()] = None,
+    status: Annotated[bool | None, Query()] = None,
+) -> ResponseModel:
+    user_select = await user_service.get_select(
+        q=query, role=role, status=status
+    )
+    page_data = await cursor_paging_data(
+        db,
+        user_select,
+        GetUserInfoListDetails,
+        request=request,
+        params=params,
+        order_column=User.join_time,
+        id_column=User.id,
+    )
+    return response_base.success(request=request, data=page_data)
+
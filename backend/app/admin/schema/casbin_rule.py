@@ -32,6 +32,15 @@ class DeleteUserRoleParam(CreateUserRoleParam):
     pass
 
 
+class CheckPolicyParam(SchemaBase):
+    path: str = Field(..., description='api path')
+    method: MethodType = Field(default=MethodType.GET, description='Request method')
+
+
+class GetPolicyCheckDetails(CheckPolicyParam):
+    allowed: bool = Field(..., description='Whether the current user may perform the request')
+
+
 class GetPolicyListDetails(SchemaBase):
     model_config = ConfigDict(from_attributes=True)
 
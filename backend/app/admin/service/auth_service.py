@@ -16,11 +16,11 @@ from backend.common.security.jwt import (
     create_refresh_token,
     get_token,
     jwt_decode,
-    password_verify,
+    revoke_user_tokens,
 )
+from backend.common.security.hasher import password_hasher
 from backend.core.conf import settings
 from backend.database.db_postgres import async_db_session
-from backend.database.db_redis import redis_client
 from backend.utils.timezone import timezone
 from backend.utils.translator import Translator
 
@@ -32,10 +32,15 @@ class AuthService:
             current_user = await user_dao.get_by_email(db, obj.username)
             if not current_user:
                 raise errors.NotFoundError(msg='Incorrect email or password')
-            elif not password_verify(f'{obj.password}{current_user.salt}', current_user.password):
+            verified, new_hash = await password_hasher.verify_and_update(
+                f'{obj.password}{current_user.salt}', current_user.password
+            )
+            if not verified:
                 raise errors.AuthorizationError(msg='Incorrect email or password')
             elif not current_user.status:
                 raise errors.AuthorizationError(msg='The user has been locked out. Please contact the system useristrator.')
+            if new_hash:
+                await user_dao.reset_password(db, current_user.id, new_hash)
             access_token = await create_access_token(str(current_user.x_id), False)
             await user_dao.update_login_time(db, obj.username)
             return access_token.access_token, current_user
@@ -112,10 +117,16 @@ class AuthService:
                 user_x_id = current_user.x_id
                 email = current_user.email
 
-                if not password_verify(obj.password + current_user.salt, current_user.password):
+                verified, new_hash = await password_hasher.verify_and_update(
+                    obj.password + current_user.salt, current_user.password
+                )
+                if not verified:
                     raise errors.AuthorizationError(msg=translator.t('auth.incorrect_credential'))
                 elif not current_user.status:
                     raise errors.AuthorizationError(msg=translator.t('auth.account_locked'))
+                if new_hash:
+                    # Stored with an outdated cost, persist the rehash transparently
+                    await user_dao.reset_password(db, current_user.id, new_hash)
 
                 access_token = await create_access_token(str(user_x_id), False)
                 refresh_token = await create_refresh_token(str(user_x_id), False)
@@ -224,10 +235,7 @@ class AuthService:
         #         key = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{request.user.id}:{refresh_token}'
         #         await redis_client.delete(key)
         # else:
-        key_prefix = f'{settings.TOKEN_REDIS_PREFIX}:{request.user.x_id}:'
-        await redis_client.delete_prefix(key_prefix)
-        key_prefix = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{request.user.x_id}:'
-        await redis_client.delete_prefix(key_prefix)
+        await revoke_user_tokens(request.user.x_id)
 
 
 auth_service = AuthService()
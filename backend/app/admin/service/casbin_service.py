@@ -1,14 +1,17 @@
 from uuid import UUID
 
+from fastapi import Request
 from sqlalchemy import Select
 
 from backend.crud.crud_casbin import casbin_dao
 from backend.app.admin.schema.casbin_rule import (
+    CheckPolicyParam,
     CreatePolicyParam,
     CreateUserRoleParam,
     DeleteAllPoliciesParam,
     DeletePolicyParam,
     DeleteUserRoleParam,
+    GetPolicyCheckDetails,
     UpdatePolicyParam,
 )
 from backend.common.exception import errors
@@ -27,108 +30,132 @@ class CasbinService:
         if role is not None:
             data = enforcer.get_filtered_named_policy('p', 0, str(role))
         else:
-            data = enforcer.get_policy()
+            # The enforcer only holds role-level rules, per-user rules are read from the database
+            async with async_db_session() as db:
+                data = await casbin_dao.get_rules(db, 'p')
+        return data
+
+    @staticmethod
+    async def check_policies(*, request: Request, ps: list[CheckPolicyParam]) -> list[GetPolicyCheckDetails]:
+        data = []
+        for p in ps:
+            allowed = await rbac.check(request, p.method.value, p.path)
+            data.append(GetPolicyCheckDetails(path=p.path, method=p.method, allowed=allowed))
         return data
 
     @staticmethod
     async def create_policy(*, p: CreatePolicyParam) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(p.sub)
         data = await enforcer.add_policy(p.sub, p.path, p.method)
         if not data:
             raise errors.ForbiddenError(msg='Permission already exists')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def create_policies(*, ps: list[CreatePolicyParam]) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(*(p.sub for p in ps))
         data = await enforcer.add_policies([list(p.model_dump().values()) for p in ps])
         if not data:
             raise errors.ForbiddenError(msg='Permission already exists')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def update_policy(*, old: UpdatePolicyParam, new: UpdatePolicyParam) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(old.sub, new.sub)
         _p = enforcer.has_policy(old.sub, old.path, old.method)
         if not _p:
             raise errors.NotFoundError(msg='Permission does not exist')
         data = await enforcer.update_policy([old.sub, old.path, old.method], [new.sub, new.path, new.method])
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def update_policies(*, old: list[UpdatePolicyParam], new: list[UpdatePolicyParam]) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(*(p.sub for p in [*old, *new]))
         data = await enforcer.update_policies(
             [list(o.model_dump().values()) for o in old], [list(n.model_dump().values()) for n in new]
         )
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_policy(*, p: DeletePolicyParam) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(p.sub)
         _p = enforcer.has_policy(p.sub, p.path, p.method)
         if not _p:
             raise errors.NotFoundError(msg='Permission does not exist')
         data = await enforcer.remove_policy(p.sub, p.path, p.method)
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_policies(*, ps: list[DeletePolicyParam]) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(*(p.sub for p in ps))
         data = await enforcer.remove_policies([list(p.model_dump().values()) for p in ps])
         if not data:
             raise errors.NotFoundError(msg='Permission does not exist')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_all_policies(*, sub: DeleteAllPoliciesParam) -> int:
         async with async_db_session.begin() as db:
             count = await casbin_dao.delete_policies_by_sub(db, sub)
+        # Raw delete bypasses the enforcer, every worker must reload
+        await rbac.policy_changed()
         return count
 
     @staticmethod
     async def get_group_list() -> list:
-        enforcer = await rbac.enforcer()
-        data = enforcer.get_grouping_policy()
+        async with async_db_session() as db:
+            data = await casbin_dao.get_rules(db, 'g')
         return data
 
     @staticmethod
     async def create_group(*, g: CreateUserRoleParam) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(g.uuid)
         data = await enforcer.add_grouping_policy(g.uuid, g.role)
         if not data:
             raise errors.ForbiddenError(msg='Permission already exists')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def create_groups(*, gs: list[CreateUserRoleParam]) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(*(g.uuid for g in gs))
         data = await enforcer.add_grouping_policies([list(g.model_dump().values()) for g in gs])
         if not data:
             raise errors.ForbiddenError(msg='Permission already exists')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_group(*, g: DeleteUserRoleParam) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(g.uuid)
         _g = enforcer.has_grouping_policy(g.uuid, g.role)
         if not _g:
             raise errors.NotFoundError(msg='Permission does not exist')
         data = await enforcer.remove_grouping_policy(g.uuid, g.role)
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_groups(*, gs: list[DeleteUserRoleParam]) -> bool:
-        enforcer = await rbac.enforcer()
+        enforcer = await rbac.load_subjects(*(g.uuid for g in gs))
         data = await enforcer.remove_grouping_policies([list(g.model_dump().values()) for g in gs])
         if not data:
             raise errors.NotFoundError(msg='Permission does not exist')
+        await rbac.policy_changed()
         return data
 
     @staticmethod
     async def delete_all_groups(*, uuid: UUID) -> int:
         async with async_db_session.begin() as db:
             count = await casbin_dao.delete_groups_by_uuid(db, uuid)
+        # Raw delete bypasses the enforcer, every worker must reload
+        await rbac.policy_changed()
         return count
 
 
@@ -27,18 +27,21 @@ class LoginLogService:
         msg: str,
     ) -> None:
         try:
+            context = request.state.context
+            ip_info = await context.ip_info()
+            ua_info = context.ua_info
             obj_in = CreateLoginLogParam(
                 user_x_id=user_x_id,
                 email=email,
                 status=status,
-                ip=request.state.ip,
-                country=request.state.country,
-                region=request.state.region,
-                city=request.state.city,
-                user_agent=request.state.user_agent,
-                browser=request.state.browser,
-                os=request.state.os,
-                device=request.state.device,
+                ip=ip_info.ip,
+                country=ip_info.country,
+                region=ip_info.region,
+                city=ip_info.city,
+                user_agent=ua_info.user_agent,
+                browser=ua_info.browser,
+                os=ua_info.os,
+                device=ua_info.device,
                 msg=msg,
                 login_time=login_time,
             )
@@ -1,8 +1,15 @@
+import asyncio
+
 from sqlalchemy import Select
 
 from backend.crud.crud_opera_log import opera_log_dao
 from backend.app.admin.schema.opera_log import CreateOperaLogParam
+from backend.common.enums import OperaLogCipherType
+from backend.common.log import log
+from backend.core.conf import settings
 from backend.database.db_postgres import async_db_session
+from backend.utils.encrypt import AESCipher, desensitize
+from backend.utils.prometheus import OPERA_LOG_QUEUE_SIZE, OPERA_LOG_RECORDS
 
 
 class OperaLogService:
@@ -28,4 +35,117 @@ class OperaLogService:
             return count
 
 
+class OperaLogWriter:
+    """Buffers operation logs in a bounded queue, a single background task writes them in bulk"""
+
+    def __init__(self):
+        self._queue: asyncio.Queue[CreateOperaLogParam] | None = None
+        self._task: asyncio.Task | None = None
+        # AES is applied here rather than in the middleware, so requests never pay for it
+        self._encrypt_keys = frozenset(settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE)
+        self._aes = (
+            AESCipher(settings.OPERA_LOG_ENCRYPT_SECRET_KEY)
+            if settings.OPERA_LOG_ENCRYPT_TYPE == OperaLogCipherType.aes
+            else None
+        )
+
+    async def start(self) -> None:
+        """
+        Start the background writer
+
+        :return:
+        """
+        if self._task is None:
+            self._queue = asyncio.Queue(maxsize=settings.OPERA_LOG_QUEUE_MAXSIZE)
+            OPERA_LOG_QUEUE_SIZE.set_function(self._queue.qsize)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Flush the buffered records and stop the background writer
+
+        :return:
+        """
+        if self._task is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), settings.OPERA_LOG_DRAIN_TIMEOUT_SECONDS)
+        except TimeoutError:
+            log.warning(f'Operation log drain timed out, {self._queue.qsize()} records lost')
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+
+    async def put(self, obj_in: CreateOperaLogParam) -> None:
+        """
+        Queue an operation log, waiting briefly for room when the queue is full
+
+        :param obj_in:
+        :return:
+        """
+        if self._queue is None:
+            # Normally started by the lifespan, never write inline on the request path
+            await self.start()
+        try:
+            self._queue.put_nowait(obj_in)
+        except asyncio.QueueFull:
+            try:
+                await asyncio.wait_for(self._queue.put(obj_in), settings.OPERA_LOG_QUEUE_PUT_TIMEOUT_SECONDS)
+            except TimeoutError:
+                OPERA_LOG_RECORDS.labels(result='dropped_full').inc()
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + settings.OPERA_LOG_FLUSH_INTERVAL_SECONDS
+            while len(batch) < settings.OPERA_LOG_BATCH_SIZE:
+                if not self._queue.empty():
+                    batch.append(self._queue.get_nowait())
+                    continue
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except TimeoutError:
+                    break
+            await self._flush(batch)
+
+    def _encrypt(self, obj_in: CreateOperaLogParam) -> CreateOperaLogParam:
+        if self._aes is not None and obj_in.args:
+            obj_in.args = desensitize(obj_in.args, self._encrypt_keys, lambda value: self._aes.encrypt(value).hex())
+        return obj_in
+
+    async def _flush(self, batch: list[CreateOperaLogParam]) -> None:
+        try:
+            # A record that fails to encrypt is dropped alone, not with its batch
+            objs_in = []
+            for obj_in in batch:
+                try:
+                    objs_in.append(self._encrypt(obj_in))
+                except Exception as e:
+                    log.error(f'Operation log encryption failure, record {obj_in.trace_id} dropped: {e}')
+                    OPERA_LOG_RECORDS.labels(result='dropped_error').inc()
+            if not objs_in:
+                return
+            try:
+                async with async_db_session.begin() as db:
+                    await opera_log_dao.bulk_create(db, objs_in)
+                OPERA_LOG_RECORDS.labels(result='written').inc(len(objs_in))
+            except Exception as e:
+                log.error(f'Operation log bulk write failure: {e}')
+                OPERA_LOG_RECORDS.labels(result='dropped_error').inc(len(objs_in))
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
 opera_log_service = OperaLogService()
+
+# Create an operation log writer instance
+opera_log_writer = OperaLogWriter()
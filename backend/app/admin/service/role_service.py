@@ -7,6 +7,7 @@ from backend.crud.crud_role import role_dao
 from backend.models import Role
 from backend.app.admin.schema.role import CreateRoleParam, UpdateRoleMenuParam, UpdateRoleParam
 from backend.common.exception import errors
+from backend.common.security.jwt import invalidate_users_cache
 from backend.core.conf import settings
 from backend.database.db_postgres import async_db_session
 from backend.database.db_redis import redis_client
@@ -66,14 +67,21 @@ class RoleService:
                 if role:
                     raise errors.ForbiddenError(msg='already exists')
             count = await role_dao.update_roleinfo(db, pk, obj)
-            return count
+            x_ids = await role_dao.get_user_x_ids(db, [pk])
+        # Cached users carry their roles
+        await invalidate_users_cache(x_ids)
+        return count
 
     
     @staticmethod
     async def delete(*, pk: list[int]) -> int:
         async with async_db_session.begin() as db:
+            # Read before the delete cascades to the user_role rows
+            x_ids = await role_dao.get_user_x_ids(db, pk)
             count = await role_dao.delete(db, pk)
-            return count
+        # Cached users carry their roles
+        await invalidate_users_cache(x_ids)
+        return count
 
 
 role_service = RoleService()
\ No newline at end of file
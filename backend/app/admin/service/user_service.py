@@ -15,10 +15,9 @@ from backend.schemas.user import (
     UpdateUserParam
 )
 from backend.common.exception import errors
-from backend.common.security.jwt import get_hash_password, password_verify, superuser_verify
-from backend.core.conf import settings
+from backend.common.security.hasher import password_hasher
+from backend.common.security.jwt import invalidate_user_cache, revoke_user_tokens, superuser_verify
 from backend.database.db_postgres import async_db_session
-from backend.database.db_redis import redis_client
 from backend.common.enums import Role as Role_enum
 
 
@@ -28,7 +27,7 @@ class ClientService:
     async def pwd_update(*, request: Request, obj: UpdatePasswordParam) -> int:
         async with async_db_session.begin() as db:
             user = await user_dao.get(db, request.user.id)
-            if not password_verify(f'{obj.old_password}{user.salt}', user.password):
+            if not await password_hasher.verify(f'{obj.old_password}{user.salt}', user.password):
                 raise errors.ForbiddenError(msg='Original password is wrong')
             
             np1 = obj.new_password
@@ -37,16 +36,11 @@ class ClientService:
             if np1 != np2:
                 raise errors.ForbiddenError(msg='Inconsistent password entry')
 
-            new_pwd = get_hash_password(f'{obj.new_password}{user.salt}')
+            new_pwd = await password_hasher.hash(f'{obj.new_password}{user.salt}')
             count = await user_dao.reset_password(db, request.user.id, new_pwd)
-            key_prefix = [
-                f'{settings.TOKEN_REDIS_PREFIX}:{request.user.id}',
-                f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{request.user.id}',
-                f'{settings.JWT_USER_REDIS_PREFIX}:{request.user.id}',
-            ]
-            for key in key_prefix:
-                await redis_client.delete_prefix(key)
-            return count
+            await revoke_user_tokens(request.user.x_id)
+        await invalidate_user_cache(request.user.x_id)
+        return count
     
     @staticmethod
     async def pwd_reset(*, email: EmailStr, token: str, obj: UserResetPassword) -> int:
@@ -63,16 +57,11 @@ class ClientService:
             if not check_token:
                 raise errors.ForbiddenError(msg='Token is invalid')
             
-            new_pwd = get_hash_password(f'{obj.new_password}{user.salt}')
+            new_pwd = await password_hasher.hash(f'{obj.new_password}{user.salt}')
             count = await user_dao.reset_password(db, user.id, new_pwd)
-            key_prefix = [
-                f'{settings.TOKEN_REDIS_PREFIX}:{user.id}',
-                f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{user.id}',
-                f'{settings.JWT_USER_REDIS_PREFIX}:{user.id}',
-            ]
-            for key in key_prefix:
-                await redis_client.delete_prefix(key)
-            return count
+            await revoke_user_tokens(user.x_id)
+        await invalidate_user_cache(user.x_id)
+        return count
         
     @staticmethod
     async def get_userinfo(*, email: str) -> User:
@@ -93,7 +82,8 @@ class ClientService:
             if not input_user:
                 raise errors.NotFoundError(msg='The user does not exist')
             count = await user_dao.update_profile_image(db, input_user.id, profile_image)
-            return count
+        await invalidate_user_cache(input_user.x_id)
+        return count
     
     @staticmethod
     async def update(*, id: int, obj: UpdateUserParam) -> int:
@@ -103,7 +93,8 @@ class ClientService:
                 raise errors.NotFoundError(msg='The user does not exist')
 
             count = await user_dao.update_user_info(db, id, obj.model_dump(exclude_none=True, exclude_unset=True, exclude={}))
-            return count
+        await invalidate_user_cache(input_user.x_id)
+        return count
     @staticmethod
     async def get_profile(*, id: int) -> User:
         async with async_db_session() as db:
@@ -136,13 +127,9 @@ class ClientService:
             if not input_user:
                 raise errors.NotFoundError(msg='The user does not exist')
             count = await user_dao.delete(db, input_user.id)
-            key_prefix = [
-                f'{settings.TOKEN_REDIS_PREFIX}:{input_user.id}',
-                f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{input_user.id}',
-            ]
-            for key in key_prefix:
-                await redis_client.delete_prefix(key)
-            return count
+            await revoke_user_tokens(input_user.x_id)
+        await invalidate_user_cache(input_user.x_id)
+        return count
 
     @staticmethod
     async def get_by_x_id(x_id: str) -> User | None:
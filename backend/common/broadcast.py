@@ -0,0 +1,87 @@
+import asyncio
+
+from typing import Any, Awaitable, Callable
+
+from backend.common.log import log
+from backend.database.db_redis import redis_client
+
+BroadcastHandler = Callable[[str], Awaitable[Any]]
+
+
+class Broadcast:
+    """Redis pub/sub bus used to propagate cache invalidations across workers and nodes"""
+
+    def __init__(self):
+        self._handlers: dict[str, list[BroadcastHandler]] = {}
+        self._task: asyncio.Task | None = None
+
+    def subscribe(self, channel: str, handler: BroadcastHandler) -> None:
+        """
+        Register a handler for a channel, must be called before start
+
+        :param channel:
+        :param handler: Coroutine function receiving the published message
+        :return:
+        """
+        self._handlers.setdefault(channel, []).append(handler)
+
+    async def publish(self, channel: str, message: str | int) -> None:
+        """
+        Publish a message to every subscribed worker, including this one
+
+        :param channel:
+        :param message:
+        :return:
+        """
+        await redis_client.publish(channel, message)
+
+    async def start(self) -> None:
+        """
+        Start listening to all registered channels
+
+        :return:
+        """
+        if self._task is None and self._handlers:
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self) -> None:
+        """
+        Stop listening
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _listen(self) -> None:
+        while True:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(*self._handlers.keys())
+                while True:
+                    # Bounded reads, a blocking listen() would trip the client socket timeout when idle
+                    message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                    if message is None or message.get('type') != 'message':
+                        continue
+                    for handler in self._handlers.get(message['channel'], []):
+                        try:
+                            await handler(message['data'])
+                        except Exception as e:
+                            log.error(f'Broadcast handler exception on {message["channel"]}: {e}')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Messages published while disconnected are lost, handlers should tolerate it
+                log.error(f'Broadcast connection lost, resubscribing: {e}')
+                await asyncio.sleep(1)
+            finally:
+                await pubsub.aclose()
+
+
+# Create a broadcast instance
+broadcast = Broadcast()
@@ -29,7 +29,7 @@ class RequestCallNext:
     msg: str
     status: StatusType
     err: Exception | None
-    response: Response
+    response: Response | None
 
 
 @dataclasses.dataclass
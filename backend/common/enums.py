@@ -52,6 +52,14 @@ class MethodType(StrEnum):
     OPTIONS = 'OPTIONS'
 
 
+class CountStrategy(StrEnum):
+    """Paging total count strategy"""
+
+    exact = 'exact'
+    estimated = 'estimated'
+    cached = 'cached'
+
+
 class OperaLogCipherType(IntEnum):
     """Operation log encryption type"""
 
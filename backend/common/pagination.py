@@ -1,18 +1,30 @@
 from __future__ import annotations
 
+import base64
+import hashlib
+import json
 import math
 
-from typing import TYPE_CHECKING, Dict, Generic, Sequence, TypeVar
+from datetime import datetime
+from typing import TYPE_CHECKING, Annotated, Any, Dict, Generic, Sequence, TypeVar
 
-from fastapi import Depends, Query
+from fastapi import Depends, Query, Request
 from fastapi_pagination import pagination_ctx
 from fastapi_pagination.bases import AbstractPage, AbstractParams, RawParams
-from fastapi_pagination.ext.sqlalchemy import paginate
+from fastapi_pagination.ext.sqlalchemy import create_count_query, paginate
 from fastapi_pagination.links.bases import create_links
 from pydantic import BaseModel
+from sqlalchemy import Table, literal, text, tuple_
+from sqlalchemy import select as sa_select
+
+from backend.common.enums import CountStrategy
+from backend.common.exception import errors
+from backend.common.log import log
+from backend.core.conf import settings
+from backend.database.db_redis import redis_client
 
 if TYPE_CHECKING:
-    from sqlalchemy import Select
+    from sqlalchemy import ColumnElement, Select
     from sqlalchemy.ext.asyncio import AsyncSession
 
 T = TypeVar('T')
@@ -38,6 +50,7 @@ class _Page(AbstractPage[T], Generic[T]):
     size: int  # per page
     total_pages: int  # of total pages
     links: Dict[str, str | None]  # Jump links
+    count_strategy: CountStrategy = CountStrategy.exact  # How total was obtained, only exact is exact
 
     __params_type__ = _Params  # Use custom Params
 
@@ -47,6 +60,7 @@ class _Page(AbstractPage[T], Generic[T]):
         items: Sequence[T],
         total: int,
         params: _Params,
+        count_strategy: CountStrategy = CountStrategy.exact,
     ) -> _Page[T]:
         page = params.page
         size = params.size
@@ -58,26 +72,201 @@ class _Page(AbstractPage[T], Generic[T]):
             'prev': {'page': f'{page - 1}', 'size': f'{size}'} if (page - 1) >= 1 else None,
         }).model_dump()
 
-        return cls(items=items, total=total, page=params.page, size=params.size, total_pages=total_pages, links=links)
+        return cls(
+            items=items,
+            total=total,
+            page=params.page,
+            size=params.size,
+            total_pages=total_pages,
+            links=links,
+            count_strategy=count_strategy,
+        )
 
 
 class _PageData(BaseModel, Generic[DataT]):
     page_data: DataT | None = None
 
 
-async def paging_data(db: AsyncSession, select: Select, page_data_schema: SchemaT) -> dict:
+async def _exact_count(db: AsyncSession, select: Select) -> int:
+    return await db.scalar(create_count_query(select))
+
+
+async def _estimated_count(db: AsyncSession, select: Select) -> tuple[int, CountStrategy]:
+    """
+    Planner estimate of the row count, recounted exactly when small enough for an exact count to be cheap
+
+    :param db:
+    :param select:
+    :return: The total and the strategy it was actually obtained with
+    """
+    dialect = db.get_bind().dialect
+    froms = select.get_final_froms()
+    try:
+        # A failed estimate must not abort the surrounding transaction
+        async with db.begin_nested():
+            if select.whereclause is None and len(froms) == 1 and isinstance(froms[0], Table):
+                # Statistics of a partitioned table are kept on its partitions
+                estimate = await db.scalar(
+                    text(
+                        'SELECT coalesce(sum(c.reltuples) FILTER (WHERE c.reltuples > 0), 0)::bigint '
+                        'FROM pg_class c WHERE c.oid = CAST(:table AS regclass) '
+                        'OR c.oid IN (SELECT inhrelid FROM pg_inherits WHERE inhparent = CAST(:table AS regclass))'
+                    ),
+                    {'table': dialect.identifier_preparer.format_table(froms[0])},
+                )
+            else:
+                query = select.order_by(None).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+                conn = await db.connection()
+                plan = (await conn.exec_driver_sql(f'EXPLAIN (FORMAT JSON) {query}')).scalar()
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                estimate = int(plan[0]['Plan']['Plan Rows'])
+    except Exception as e:
+        log.warning(f'Failed to estimate the paging count, falling back to an exact count: {e}')
+        return await _exact_count(db, select), CountStrategy.exact
+    if estimate < settings.PAGINATION_EXACT_COUNT_THRESHOLD:
+        return await _exact_count(db, select), CountStrategy.exact
+    return estimate, CountStrategy.estimated
+
+
+async def _cached_count(db: AsyncSession, select: Select) -> tuple[int, CountStrategy]:
+    """
+    Exact count memoized in redis for the same statement and filter values
+
+    :param db:
+    :param select:
+    :return: The total and the strategy it was actually obtained with
+    """
+    compiled = select.compile(dialect=db.get_bind().dialect)
+    digest = hashlib.sha1(
+        json.dumps([str(compiled), compiled.params], sort_keys=True, default=str).encode()
+    ).hexdigest()
+    key = f'{settings.PAGINATION_COUNT_REDIS_PREFIX}:{digest}'
+    total = await redis_client.get(key)
+    if total is not None:
+        return int(total), CountStrategy.cached
+    total = await _exact_count(db, select)
+    await redis_client.setex(key, settings.PAGINATION_COUNT_CACHE_EXPIRE_SECONDS, total)
+    return total, CountStrategy.exact
+
+
+async def paging_data(
+    db: AsyncSession,
+    select: Select,
+    page_data_schema: SchemaT,
+    count_strategy: CountStrategy = CountStrategy.exact,
+) -> dict:
     """
     Creating Paged Data Based on SQLAlchemy
 
     :param db:
     :param select:
     :param page_data_schema:
+    :param count_strategy: How the total is requested, the page reports the one actually used (exact on fallback)
     :return:
     """
-    _paginate = await paginate(db, select)
+    count_query = None
+    if count_strategy != CountStrategy.exact:
+        count = _estimated_count if count_strategy == CountStrategy.estimated else _cached_count
+        total, count_strategy = await count(db, select)
+        count_query = sa_select(literal(total))
+    _paginate = await paginate(
+        db, select, count_query=count_query, additional_data={'count_strategy': count_strategy}
+    )
     page_data = _PageData[_Page[page_data_schema]](page_data=_paginate).model_dump()['page_data']
     return page_data
 
 
+class _CursorParams(BaseModel):
+    cursor: str | None = Query(None, description='Opaque cursor from the next / prev links')
+    size: int = Query(10, gt=0, le=100, description='Page size')   # Default 10 records
+
+
+class _CursorPage(BaseModel, Generic[T]):
+    items: Sequence[T]  # Data
+    size: int  # per page
+    links: Dict[str, str | None]  # Jump links, no total is counted
+
+
+def _encode_cursor(direction: str, key: tuple[datetime, int]) -> str:
+    raw = json.dumps([direction, key[0].isoformat(), key[1]], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def _decode_cursor(cursor: str) -> tuple[str, tuple[datetime, int]]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, key_time, key_id = json.loads(raw)
+        if direction not in ('next', 'prev'):
+            raise ValueError(direction)
+        return direction, (datetime.fromisoformat(key_time), int(key_id))
+    except (ValueError, TypeError):
+        raise errors.RequestError(msg='Invalid pagination cursor')
+
+
+async def cursor_paging_data(
+    db: AsyncSession,
+    select: Select,
+    page_data_schema: SchemaT,
+    *,
+    request: Request,
+    params: _CursorParams,
+    order_column: ColumnElement,
+    id_column: ColumnElement,
+) -> dict:
+    """
+    Creating keyset paged data based on SQLAlchemy, newest first
+
+    Pages are seeked on (order_column, id_column) instead of skipped with an offset,
+    so any page costs the same as the first one
+
+    :param db:
+    :param select: Filtered select, its own ordering is replaced
+    :param page_data_schema:
+    :param request:
+    :param params:
+    :param order_column: Sort column, e.g. created_time
+    :param id_column: Unique tiebreaker, e.g. id
+    :return:
+    """
+    direction, key = _decode_cursor(params.cursor) if params.cursor else ('next', None)
+    stmt = select.order_by(None)
+    if direction == 'next':
+        if key is not None:
+            stmt = stmt.where(tuple_(order_column, id_column) < key)
+        stmt = stmt.order_by(order_column.desc(), id_column.desc())
+    else:
+        stmt = stmt.where(tuple_(order_column, id_column) > key)
+        stmt = stmt.order_by(order_column.asc(), id_column.asc())
+    # One extra row tells whether there is a page beyond this one, unique() for joined eager loaded collections
+    rows = list((await db.scalars(stmt.limit(params.size + 1))).unique().all())
+    has_more = len(rows) > params.size
+    rows = rows[: params.size]
+    if direction == 'prev':
+        rows.reverse()
+
+    def _key(row: Any) -> tuple[datetime, int]:
+        return getattr(row, order_column.key), getattr(row, id_column.key)
+
+    def _link(cursor: str | None) -> str:
+        url = request.url.remove_query_params('cursor').include_query_params(size=params.size)
+        if cursor is not None:
+            url = url.include_query_params(cursor=cursor)
+        return f'{url.path}?{url.query}'
+
+    has_next = has_more if direction == 'next' else key is not None
+    has_prev = key is not None if direction == 'next' else has_more
+    links = {
+        'first': _link(None),
+        'next': _link(_encode_cursor('next', _key(rows[-1]))) if rows and has_next else None,
+        'prev': _link(_encode_cursor('prev', _key(rows[0]))) if rows and has_prev else None,
+    }
+    items = [page_data_schema.model_validate(row) for row in rows]
+    return _CursorPage[page_data_schema](items=items, size=params.size, links=links).model_dump()
+
+
 # Paging dependency injection
 DependsPagination = Depends(pagination_ctx(_Page))
+
+# Cursor paging parameters injection
+CursorParams = Annotated[_CursorParams, Depends()]
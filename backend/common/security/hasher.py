@@ -0,0 +1,173 @@
+import asyncio
+import time
+
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from backend.common.log import log
+from backend.core.conf import settings
+from backend.database.db_redis import redis_client
+from backend.utils.prometheus import PASSWORD_HASH_DURATION, PASSWORD_HASH_IN_PROGRESS, PASSWORD_HASH_QUEUED
+
+pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+
+
+def _hash(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def _verify(plain_password: str, hashed_password: str) -> bool:
+    return pwd_context.verify(plain_password, hashed_password)
+
+
+def _verify_and_update(plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+def _set_rounds(rounds: int) -> None:
+    # A floor: weaker hashes are reported by needs_update / verify_and_update, stronger ones are kept
+    pwd_context.update(bcrypt__default_rounds=rounds, bcrypt__min_rounds=rounds)
+
+
+def calibrate(target_ms: int) -> int:
+    """
+    Find the bcrypt cost whose hash time on this machine is closest to the target
+
+    Each extra round doubles the work, so at most a couple of hashes above the target are timed
+
+    :param target_ms: Target time per hash in milliseconds
+    :return:
+    """
+    bcrypt = pwd_context.handler('bcrypt')
+    previous = None
+    for rounds in range(bcrypt.min_rounds, bcrypt.max_rounds + 1):
+        start = time.perf_counter()
+        bcrypt.using(rounds=rounds).hash('calibration')
+        elapsed = (time.perf_counter() - start) * 1000
+        if elapsed >= target_ms:
+            if previous is not None and target_ms - previous < elapsed - target_ms:
+                return rounds - 1
+            return rounds
+        previous = elapsed
+    return bcrypt.max_rounds
+
+
+class PasswordHasher:
+    """bcrypt hashing and verification on a bounded executor, so it never blocks the event loop"""
+
+    def __init__(self):
+        self._executor: Executor | None = None
+        self.rounds: int | None = None
+        # Bounds the work handed to the executor, callers beyond it wait here and are counted as queued
+        self._semaphore = asyncio.Semaphore(settings.PASSWORD_HASH_MAX_CONCURRENCY)
+
+    def _get_executor(self) -> Executor:
+        if self._executor is None:
+            if settings.PASSWORD_HASH_EXECUTOR == 'process':
+                self._executor = ProcessPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS,
+                    initializer=_set_rounds if self.rounds else None,
+                    initargs=(self.rounds,) if self.rounds else (),
+                )
+            else:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.PASSWORD_HASH_WORKERS, thread_name_prefix='password-hasher'
+                )
+        return self._executor
+
+    async def setup(self) -> None:
+        """
+        Apply the configured bcrypt cost, or the cost calibrated against PASSWORD_HASH_TARGET_MS
+
+        The calibration runs once for the whole deployment and is kept in redis,
+        workers settling on different costs would rehash passwords back and forth
+
+        :return:
+        """
+        if settings.PASSWORD_HASH_ROUNDS:
+            self.set_rounds(settings.PASSWORD_HASH_ROUNDS)
+        elif settings.PASSWORD_HASH_CALIBRATE:
+            rounds = await redis_client.get(settings.PASSWORD_HASH_ROUNDS_REDIS_KEY)
+            if rounds is None:
+                rounds = await asyncio.to_thread(calibrate, settings.PASSWORD_HASH_TARGET_MS)
+                if await redis_client.set(settings.PASSWORD_HASH_ROUNDS_REDIS_KEY, rounds, nx=True):
+                    log.info(
+                        f'Password hash cost calibrated to {rounds} rounds for {settings.PASSWORD_HASH_TARGET_MS} ms'
+                    )
+                else:
+                    # Another worker calibrated first
+                    rounds = await redis_client.get(settings.PASSWORD_HASH_ROUNDS_REDIS_KEY)
+            self.set_rounds(int(rounds))
+
+    def set_rounds(self, rounds: int) -> None:
+        """
+        Set the bcrypt cost used for new hashes, hashes with a lower cost are rehashed on login
+
+        :param rounds:
+        :return:
+        """
+        self.rounds = rounds
+        _set_rounds(rounds)
+        if isinstance(self._executor, ProcessPoolExecutor):
+            # Worker processes hold their own context, recreate them with the new cost
+            self.shutdown()
+
+    async def _run(self, operation: str, fn, *args):
+        queued = PASSWORD_HASH_QUEUED.labels(operation=operation)
+        queued.inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            queued.dec()
+        try:
+            with (
+                PASSWORD_HASH_IN_PROGRESS.labels(operation=operation).track_inprogress(),
+                PASSWORD_HASH_DURATION.labels(operation=operation).time(),
+            ):
+                return await asyncio.get_running_loop().run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self._semaphore.release()
+
+    async def hash(self, password: str) -> str:
+        """
+        Encrypt passwords using the hash algorithm
+
+        :param password:
+        :return:
+        """
+        return await self._run('hash', _hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Password verification
+
+        :param plain_password: The password to verify
+        :param hashed_password: The hash ciphers to compare
+        :return:
+        """
+        return await self._run('verify', _verify, plain_password, hashed_password)
+
+    async def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, str | None]:
+        """
+        Password verification, also returning a new hash when the stored one uses outdated parameters
+
+        :param plain_password: The password to verify
+        :param hashed_password: The hash ciphers to compare
+        :return: Whether the password matches, and the replacement hash if it should be persisted
+        """
+        return await self._run('verify', _verify_and_update, plain_password, hashed_password)
+
+    def shutdown(self) -> None:
+        """
+        Shut the executor down
+
+        :return:
+        """
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# Create a password hasher instance
+password_hasher = PasswordHasher()
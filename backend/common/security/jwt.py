@@ -1,45 +1,82 @@
-from datetime import timedelta
+import hashlib
+import time
+
+from datetime import datetime, timedelta
+from typing import Sequence
 
 from fastapi import Depends, Request
 from fastapi.security import HTTPBearer
 from fastapi.security.utils import get_authorization_scheme_param
 from jose import ExpiredSignatureError, JWTError, jwt
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend.models import User
+from backend.schemas.user import CurrentUserIns
+from backend.common.broadcast import broadcast
 from backend.common.dataclasses import AccessToken, NewToken, RefreshToken
 from backend.common.exception.errors import AuthorizationError, TokenError
 from backend.core.conf import settings
 from backend.database.db_redis import redis_client
+from backend.utils.cache import LRUCache
 from backend.utils.timezone import timezone
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+# Token digest -> (sub, exp timestamp) of recently verified tokens
+token_cache: LRUCache[bytes, tuple[str, float]] = LRUCache(
+    settings.TOKEN_VERIFY_CACHE_MAXSIZE, settings.TOKEN_VERIFY_CACHE_EXPIRE_SECONDS
+)
+
+# Sub -> validated current user, local tier in front of the redis user cache
+user_cache: LRUCache[str, CurrentUserIns] = LRUCache(
+    settings.JWT_USER_CACHE_MAXSIZE, settings.JWT_USER_CACHE_EXPIRE_SECONDS
+)
 
 
 # JWT authorizes dependency injection
 DependsJwtAuth = Depends(HTTPBearer())
 
 
-def get_hash_password(password: str) -> str:
+def _token_index_key(sub: str) -> str:
+    return f'{settings.TOKEN_INDEX_REDIS_PREFIX}:{sub}'
+
+
+def _token_generation_key(sub: str) -> str:
+    return f'{settings.TOKEN_GENERATION_REDIS_PREFIX}:{sub}'
+
+
+async def get_token_generation(sub: str) -> int:
     """
-    Encrypt passwords using the hash algorithm
+    Get the current token generation of a user, tokens issued for an older generation are revoked
 
-    :param password:
+    :param sub:
     :return:
     """
-    return pwd_context.hash(password)
+    generation = await redis_client.get(_token_generation_key(sub))
+    return int(generation or 0)
+
+
+def _check_token_generation(payload: dict, generation: str | None) -> None:
+    if payload.get('gen', 0) != int(generation or 0):
+        raise TokenError(msg='Token has expired')
 
 
-def password_verify(plain_password: str, hashed_password: str) -> bool:
+async def revoke_user_tokens(sub: str) -> None:
     """
-    Password verification
+    Revoke every access and refresh token of a user
+
+    Bumping the generation invalidates all outstanding tokens at once, the indexed
+    token keys are then deleted without scanning the keyspace
 
-    :param plain_password: The password to verify
-    :param hashed_password: The hash ciphers to compare
+    :param sub:
     :return:
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    await redis_client.incr(_token_generation_key(sub))
+    await redis_client.delete_user_tokens(_token_index_key(sub))
+    await revoke_token_cache(sub)
+
+
+def _encode_token(sub: str, expire: datetime, generation: int) -> str:
+    to_encode = {'exp': expire, 'sub': sub, 'gen': generation}
+    return jwt.encode(to_encode, settings.TOKEN_SECRET_KEY, settings.TOKEN_ALGORITHM)
 
 
 async def create_access_token(sub: str, multi_login: bool) -> AccessToken:
@@ -53,15 +90,14 @@ async def create_access_token(sub: str, multi_login: bool) -> AccessToken:
     expire = timezone.now() + timedelta(seconds=settings.TOKEN_EXPIRE_SECONDS)
     expire_seconds = settings.TOKEN_EXPIRE_SECONDS
 
-    to_encode = {'exp': expire, 'sub': sub}
-    access_token = jwt.encode(to_encode, settings.TOKEN_SECRET_KEY, settings.TOKEN_ALGORITHM)
+    access_token = _encode_token(sub, expire, await get_token_generation(sub))
 
     if multi_login is False:
-        key_prefix = f'{settings.TOKEN_REDIS_PREFIX}:{sub}'
-        await redis_client.delete_prefix(key_prefix)
+        await redis_client.delete_user_tokens(_token_index_key(sub), f'{settings.TOKEN_REDIS_PREFIX}:{sub}:')
+        await revoke_token_cache(sub)
 
     key = f'{settings.TOKEN_REDIS_PREFIX}:{sub}:{access_token}'
-    await redis_client.setex(key, expire_seconds, access_token)
+    await redis_client.add_user_token(_token_index_key(sub), key, access_token, expire_seconds)
     return AccessToken(access_token=access_token, access_token_expire_time=expire)
 
 
@@ -76,21 +112,21 @@ async def create_refresh_token(sub: str, multi_login: bool) -> RefreshToken:
     expire = timezone.now() + timedelta(seconds=settings.TOKEN_REFRESH_EXPIRE_SECONDS)
     expire_seconds = settings.TOKEN_REFRESH_EXPIRE_SECONDS
 
-    to_encode = {'exp': expire, 'sub': sub}
-    refresh_token = jwt.encode(to_encode, settings.TOKEN_SECRET_KEY, settings.TOKEN_ALGORITHM)
+    refresh_token = _encode_token(sub, expire, await get_token_generation(sub))
 
     if multi_login is False:
-        key_prefix = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}'
-        await redis_client.delete_prefix(key_prefix)
+        await redis_client.delete_user_tokens(
+            _token_index_key(sub), f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}:'
+        )
 
     key = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}:{refresh_token}'
-    await redis_client.setex(key, expire_seconds, refresh_token)
+    await redis_client.add_user_token(_token_index_key(sub), key, refresh_token, expire_seconds)
     return RefreshToken(refresh_token=refresh_token, refresh_token_expire_time=expire)
 
 
 async def create_new_token(sub: str, token: str, refresh_token: str, multi_login: bool) -> NewToken:
     """
-    Generate new token
+    Generate new token, the refresh token is rotated atomically so it can only be used once
 
     :param sub:
     :param token
@@ -98,22 +134,40 @@ async def create_new_token(sub: str, token: str, refresh_token: str, multi_login
     :param multi_login:
     :return:
     """
-    redis_refresh_token = await redis_client.get(f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}:{refresh_token}')
-    if not redis_refresh_token or redis_refresh_token != refresh_token:
+    generation = jwt_payload(refresh_token).get('gen', 0)
+    access_expire = timezone.now() + timedelta(seconds=settings.TOKEN_EXPIRE_SECONDS)
+    refresh_expire = timezone.now() + timedelta(seconds=settings.TOKEN_REFRESH_EXPIRE_SECONDS)
+    new_access_token = _encode_token(sub, access_expire, generation)
+    new_refresh_token = _encode_token(sub, refresh_expire, generation)
+
+    access_prefix = f'{settings.TOKEN_REDIS_PREFIX}:{sub}:'
+    refresh_prefix = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}:'
+    rotated = await redis_client.rotate_user_tokens(
+        index_key=_token_index_key(sub),
+        generation_key=_token_generation_key(sub),
+        refresh_key=f'{refresh_prefix}{refresh_token}',
+        refresh_token=refresh_token,
+        generation=generation,
+        access_key=f'{access_prefix}{token}',
+        new_access=(f'{access_prefix}{new_access_token}', new_access_token, settings.TOKEN_EXPIRE_SECONDS),
+        new_refresh=(
+            f'{refresh_prefix}{new_refresh_token}',
+            new_refresh_token,
+            settings.TOKEN_REFRESH_EXPIRE_SECONDS,
+        ),
+        delete_prefixes=[] if multi_login else [access_prefix, refresh_prefix],
+        revoke_channel=settings.TOKEN_REVOKE_CHANNEL,
+        revoke_message=sub,
+    )
+    if not rotated:
         raise TokenError(msg='Refresh Token has expired')
-
-    new_access_token = await create_access_token(sub, multi_login)
-    new_refresh_token = await create_refresh_token(sub, multi_login)
-
-    token_key = f'{settings.TOKEN_REDIS_PREFIX}:{sub}:{token}'
-    refresh_token_key = f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:{sub}:{refresh_token}'
-    await redis_client.delete(token_key)
-    await redis_client.delete(refresh_token_key)
+    # The script already notified the other workers
+    await _on_token_revoked(sub)
     return NewToken(
-        new_access_token=new_access_token.access_token,
-        new_access_token_expire_time=new_access_token.access_token_expire_time,
-        new_refresh_token=new_refresh_token.refresh_token,
-        new_refresh_token_expire_time=new_refresh_token.refresh_token_expire_time,
+        new_access_token=new_access_token,
+        new_access_token_expire_time=access_expire,
+        new_refresh_token=new_refresh_token,
+        new_refresh_token_expire_time=refresh_expire,
     )
 
 
@@ -130,9 +184,9 @@ def get_token(request: Request) -> str:
     return token
 
 
-def jwt_decode(token: str) -> int:
+def jwt_payload(token: str) -> dict:
     """
-    Decode token
+    Decode token and return its claims
 
     :param token:
     :return:
@@ -146,24 +200,140 @@ def jwt_decode(token: str) -> int:
         raise TokenError(msg='Token has expired')
     except (JWTError, Exception):
         raise TokenError(msg='Token is invalid')
-    return user_id
+    return payload
+
+
+def jwt_decode(token: str) -> int:
+    """
+    Decode token
+
+    :param token:
+    :return:
+    """
+    return jwt_payload(token)['sub']
+
+
+def cached_jwt_authentication(token: str) -> str | None:
+    """
+    JWT authentication from the local cache only
+
+    :param token:
+    :return: The sub, or None when the token was not verified recently
+    """
+    digest = hashlib.sha256(token.encode()).digest()
+    cached = token_cache.get(digest)
+    if cached is None:
+        return None
+    user_id, exp = cached
+    if exp > time.time():
+        return user_id
+    token_cache.pop(digest)
+    raise TokenError(msg='Token has expired')
 
 
 async def jwt_authentication(token: str) -> str:
     """
-    JWT authentication
+    JWT authentication, tokens verified in the last few seconds are served from the local cache
 
     :param token:
     :return:
     """
-    user_id = jwt_decode(token)
+    user_id = cached_jwt_authentication(token)
+    if user_id is not None:
+        return user_id
+    payload = jwt_payload(token)
+    user_id = payload['sub']
     key = f'{settings.TOKEN_REDIS_PREFIX}:{user_id}:{token}'
-    token_verify = await redis_client.get(key)
+    token_verify, generation = await redis_client.mget(key, _token_generation_key(user_id))
     if not token_verify:
         raise TokenError(msg='Token has expired')
+    _check_token_generation(payload, generation)
+    token_cache.set(hashlib.sha256(token.encode()).digest(), (user_id, payload['exp']))
     return user_id
 
 
+async def jwt_authentication_with_user(token: str) -> tuple[str, str | None]:
+    """
+    JWT authentication bypassing the local cache, the cached user json is fetched
+    in the same redis round trip as the token
+
+    :param token:
+    :return: The sub and the cached user json, if any
+    """
+    payload = jwt_payload(token)
+    user_id = payload['sub']
+    token_verify, generation, cache_user = await redis_client.get_token_and_user(
+        f'{settings.TOKEN_REDIS_PREFIX}:{user_id}:{token}',
+        _token_generation_key(user_id),
+        f'{settings.JWT_USER_REDIS_PREFIX}:{user_id}',
+    )
+    if not token_verify:
+        raise TokenError(msg='Token has expired')
+    _check_token_generation(payload, generation)
+    token_cache.set(hashlib.sha256(token.encode()).digest(), (user_id, payload['exp']))
+    return user_id, cache_user
+
+
+async def revoke_token_cache(sub: str) -> None:
+    """
+    Drop the cached verifications of a user's tokens on every worker,
+    must be called whenever the user's token keys are deleted
+
+    :param sub:
+    :return:
+    """
+    await _on_token_revoked(sub)
+    await broadcast.publish(settings.TOKEN_REVOKE_CHANNEL, sub)
+
+
+async def _on_token_revoked(sub: str) -> None:
+    for digest, (user_id, _) in token_cache.items():
+        if user_id == sub:
+            token_cache.pop(digest)
+
+
+async def invalidate_user_cache(sub: str | None = None) -> None:
+    """
+    Drop a cached current user from redis and from every worker,
+    must be called whenever data carried by CurrentUserIns changes
+
+    :param sub: User x_id, None to flush the local tier of every worker only, the redis tier is kept
+    :return:
+    """
+    if sub is None:
+        await _on_user_invalidated('*')
+        await broadcast.publish(settings.JWT_USER_INVALIDATE_CHANNEL, '*')
+    else:
+        await invalidate_users_cache([sub])
+
+
+async def invalidate_users_cache(subs: Sequence[str]) -> None:
+    """
+    Drop cached current users from redis and from every worker, e.g. the holders of a changed role
+
+    :param subs: User x_ids
+    :return:
+    """
+    if not subs:
+        return
+    await redis_client.delete(*(f'{settings.JWT_USER_REDIS_PREFIX}:{sub}' for sub in subs))
+    message = ','.join(subs)
+    await _on_user_invalidated(message)
+    await broadcast.publish(settings.JWT_USER_INVALIDATE_CHANNEL, message)
+
+
+async def _on_user_invalidated(message: str) -> None:
+    if message == '*':
+        user_cache.clear()
+    else:
+        for sub in message.split(','):
+            user_cache.pop(sub)
+
+
+broadcast.subscribe(settings.TOKEN_REVOKE_CHANNEL, _on_token_revoked)
+broadcast.subscribe(settings.JWT_USER_INVALIDATE_CHANNEL, _on_user_invalidated)
+
+
 async def get_current_user(db: AsyncSession, sub: str) -> User:
     """
     Get the current user through token
@@ -1,47 +1,188 @@
+import asyncio
+
 import casbin
 import casbin_async_sqlalchemy_adapter
 
+from casbin_async_sqlalchemy_adapter.adapter import Filter
 from fastapi import Depends, Request
 
+from backend.crud.crud_role import role_dao
 from backend.models.casbin_rule import CasbinRule
+from backend.common.broadcast import broadcast
 from backend.common.enums import MethodType
 from backend.common.exception.errors import AuthorizationError, TokenError
 from backend.common.security.jwt import DependsJwtAuth
+from backend.common.security.route_index import RouteIndex
+from backend.common.log import log
 from backend.core.conf import settings
-from backend.database.db_postgres import async_engine
+from backend.database.db_postgres import async_db_session, async_engine
+from backend.database.db_redis import redis_client
+from backend.utils.cache import LRUCache
+from backend.utils.prometheus import RBAC_DECISION_CACHE
+
+
+# Rule data is defined directly as static data
+_CASBIN_RBAC_MODEL_CONF_TEXT = """
+[request_definition]
+r = sub, obj, act
+
+[policy_definition]
+p = sub, obj, act
+
+[role_definition]
+g = _, _
+
+[policy_effect]
+e = some(where (p.eft == allow))
+
+[matchers]
+m = g(r.sub, p.sub) && (keyMatch(r.obj, p.obj) || keyMatch3(r.obj, p.obj)) && (r.act == p.act || p.act == "*")
+"""
+
+
+def _subject_filter(subjects: list[str]) -> Filter:
+    """Filter selecting the P and G rules whose subject (v0) is in the list"""
+    f = Filter()
+    f.ptype = ['p', 'g']
+    # An empty list would disable the v0 condition and load the whole table
+    f.v0 = subjects or ['']
+    return f
 
 
 class RBAC:
+    def __init__(self):
+        self._enforcer: casbin.AsyncEnforcer | None = None
+        self._index: RouteIndex | None = None
+        self._lock = asyncio.Lock()
+        # Version of the policy currently loaded in this worker
+        self.policy_version: int = 0
+        # (policy version, role x_ids, method, route template) -> allowed
+        self.decision_cache: LRUCache[tuple, bool] = LRUCache(
+            settings.RBAC_DECISION_CACHE_MAXSIZE, settings.RBAC_DECISION_CACHE_EXPIRE_SECONDS
+        )
+        # Role subjects resident in the enforcer, and other subjects loaded on demand for management (bounded)
+        self._role_subjects: set[str] = set()
+        self._loaded_subjects: set[str] = set()
+        # User x_id -> (index of the user's own P rules, roles granted by the user's G rules)
+        self.subject_cache: LRUCache[str, tuple[RouteIndex, tuple[str, ...]]] = LRUCache(
+            settings.RBAC_SUBJECT_CACHE_MAXSIZE
+        )
+
     @staticmethod
-    async def enforcer() -> casbin.AsyncEnforcer:
+    def new_enforcer() -> casbin.AsyncEnforcer:
         """
-        Get the Casbin enforcer
+        Create a Casbin enforcer without loading its policy
 
         :return:
         """
-        # Rule data is defined directly in the method as static data
-        _CASBIN_RBAC_MODEL_CONF_TEXT = """
-        [request_definition]
-        r = sub, obj, act
+        adapter = casbin_async_sqlalchemy_adapter.Adapter(async_engine, db_class=CasbinRule)
+        model = casbin.AsyncEnforcer.new_model(text=_CASBIN_RBAC_MODEL_CONF_TEXT)
+        return casbin.AsyncEnforcer(model, adapter)
 
-        [policy_definition]
-        p = sub, obj, act
+    async def enforcer(self) -> casbin.AsyncEnforcer:
+        """
+        Get the Casbin enforcer shared by this worker, loaded on first use
 
-        [role_definition]
-        g = _, _
+        :return:
+        """
+        if self._enforcer is None:
+            async with self._lock:
+                if self._enforcer is None:
+                    await self.load_policy()
+            # Reloads triggered by other workers are only received while listening
+            await broadcast.start()
+        return self._enforcer
 
-        [policy_effect]
-        e = some(where (p.eft == allow))
+    async def _load_enforcer(self, subjects: set[str]) -> casbin.AsyncEnforcer:
+        """
+        Create an enforcer holding the rules of the subjects, never mutating the shared one:
+        casbin clears the model before reading the database, concurrent readers would see it empty
 
-        [matchers]
-        m = g(r.sub, p.sub) && (keyMatch(r.obj, p.obj) || keyMatch3(r.obj, p.obj)) && (r.act == p.act || p.act == "*")
+        :param subjects:
+        :return:
         """
-        adapter = casbin_async_sqlalchemy_adapter.Adapter(async_engine, db_class=CasbinRule)
-        model = casbin.AsyncEnforcer.new_model(text=_CASBIN_RBAC_MODEL_CONF_TEXT)
-        enforcer = casbin.AsyncEnforcer(model, adapter)
-        await enforcer.load_policy()
+        enforcer = self.new_enforcer()
+        await enforcer.load_filtered_policy(_subject_filter(list(subjects)))
         return enforcer
 
+    async def load_policy(self) -> None:
+        """
+        (Re)load the role-level policy from the database into a new shared enforcer,
+        per-user rules are loaded lazily by subject_rules
+
+        :return:
+        """
+        version = await redis_client.get(settings.RBAC_CASBIN_POLICY_VERSION_KEY)
+        async with async_db_session() as db:
+            roles = await role_dao.get_all(db)
+        role_subjects = {role.x_id for role in roles}
+        enforcer = await self._load_enforcer(role_subjects)
+        self._index = RouteIndex(enforcer.get_policy(), enforcer.get_grouping_policy())
+        self._enforcer = enforcer
+        self._role_subjects = role_subjects
+        self._loaded_subjects = set()
+        self.policy_version = int(version or 0)
+        self.decision_cache.clear()
+        self.subject_cache.clear()
+
+    async def load_subjects(self, *subs: str) -> casbin.AsyncEnforcer:
+        """
+        Get the shared enforcer with the rules of non-role subjects loaded, so that management
+        operations see them; they are dropped again on the next reload
+
+        :param subs: User x_id / Role x_id
+        :return:
+        """
+        await self.enforcer()
+        async with self._lock:
+            missing = {str(sub) for sub in subs} - self._role_subjects - self._loaded_subjects
+            if missing:
+                loaded = self._loaded_subjects | missing
+                if len(loaded) > settings.RBAC_LOADED_SUBJECTS_MAXSIZE:
+                    # Start over from the role-level rules rather than growing without bound
+                    loaded = missing
+                self._enforcer = await self._load_enforcer(self._role_subjects | loaded)
+                self._loaded_subjects = loaded
+            return self._enforcer
+
+    async def subject_rules(self, sub: str) -> tuple[RouteIndex, tuple[str, ...]]:
+        """
+        Get the per-user rules of a subject, loaded from the database on first access
+
+        :param sub: User x_id
+        :return:
+        """
+        rules = self.subject_cache.get(sub)
+        if rules is None:
+            enforcer = await self.enforcer()
+            model = casbin.AsyncEnforcer.new_model(text=_CASBIN_RBAC_MODEL_CONF_TEXT)
+            await enforcer.get_adapter().load_filtered_policy(model, _subject_filter([sub]))
+            policies = model.get_policy('p', 'p')
+            roles = tuple(g[1] for g in model.get_policy('g', 'g'))
+            rules = (RouteIndex(policies, []), roles)
+            self.subject_cache.set(sub, rules)
+        return rules
+
+    async def policy_changed(self) -> None:
+        """
+        Bump the policy version, reload this worker and notify the other workers to reload,
+        must be called after any write to the casbin_rule table
+
+        :return:
+        """
+        version = await redis_client.incr(settings.RBAC_CASBIN_POLICY_VERSION_KEY)
+        # The writing worker does not wait for its own broadcast
+        async with self._lock:
+            await self.load_policy()
+        await broadcast.publish(settings.RBAC_CASBIN_POLICY_CHANNEL, version)
+
+    async def _on_policy_changed(self, message: str) -> None:
+        if int(message) == self.policy_version:
+            return
+        async with self._lock:
+            await self.load_policy()
+        log.info(f'Casbin policy reloaded, version {self.policy_version}')
+
     async def rbac_verify(self, request: Request, _token: str = DependsJwtAuth) -> None:
         """
         RBAC permission verification
@@ -50,8 +191,40 @@ class RBAC:
         :param _token:
         :return:
         """
-        path = request.url.path
+        # The matched route template keeps path parameters out of the cache key
+        route = request.scope.get('route')
+        template = f'{request.scope.get("root_path", "")}{route.path}' if route else None
+        await self.verify(request, request.method, request.url.path, template)
+
+    async def check(self, request: Request, method: str, path: str) -> bool:
+        """
+        Check whether the current user may call the path with the method, without raising;
+        arbitrary client supplied paths are kept out of the decision cache
 
+        :param request:
+        :param method:
+        :param path:
+        :return:
+        """
+        try:
+            await self.verify(request, method, path, cache=False)
+        except AuthorizationError:
+            return False
+        return True
+
+    async def verify(
+        self, request: Request, method: str, path: str, template: str | None = None, cache: bool = True
+    ) -> None:
+        """
+        Verify the current user permission for a method and path
+
+        :param request:
+        :param method:
+        :param path:
+        :param template: Route template used as decision cache key when safe, defaults to the path
+        :param cache: Store the decision in the decision cache
+        :return:
+        """
         # Whitelist for authentication
         if path in settings.TOKEN_REQUEST_PATH_EXCLUDE:
             return
@@ -69,7 +242,6 @@ class RBAC:
         if not user_roles:
             raise AuthorizationError(msg='User has no assigned roles, authorization failed')
 
-        method = request.method
         if method != MethodType.GET or method != MethodType.OPTIONS:
             if not request.user.is_staff:
                 raise AuthorizationError(msg='This user is prohibited from performing backend management operations')
@@ -80,19 +252,36 @@ class RBAC:
             return
 
 
-        for role in user_roles:
-            # Casbin permission verification
-            if (method, path) in settings.RBAC_CASBIN_EXCLUDE:
-                return
-            enforcer = await self.enforcer()
-            
+        # Casbin permission verification
+        if (method, path) in settings.RBAC_CASBIN_EXCLUDE:
+            return
+        # Make sure the policy (and its compiled index) is loaded
+        await self.enforcer()
+
+        # The template is only a valid key when no rule singles out a concrete path of it
+        cache_path = template if template and self._index.template_safe(template) else path
+        key = (self.policy_version, tuple(sorted(role.x_id for role in user_roles)), method, cache_path)
+        allowed = self.decision_cache.get(key)
+        if allowed is None:
+            RBAC_DECISION_CACHE.labels(result='miss').inc()
             # check if at least one of the user is allowed 
-            if enforcer.enforce(role.x_id, path, method):
-                return
-        
-        raise AuthorizationError
+            allowed = any(self._index.enforce(role.x_id, path, method) for role in user_roles)
+            if cache:
+                self.decision_cache.set(key, allowed)
+        else:
+            RBAC_DECISION_CACHE.labels(result='hit').inc()
+        if allowed:
+            return
 
+        # Per-user P rules, and roles granted through per-user G rules
+        sub = request.user.x_id
+        index, roles = await self.subject_rules(sub)
+        if index.enforce(sub, path, method) or any(self._index.enforce(role, path, method) for role in roles):
+            return
+
+        raise AuthorizationError
 
 rbac = RBAC()
+broadcast.subscribe(settings.RBAC_CASBIN_POLICY_CHANNEL, rbac._on_policy_changed)
 # RBAC authorization dependency injection
 DependsRBAC = Depends(rbac.rbac_verify)
@@ -91,6 +91,11 @@ class Settings(BaseSettings):
     ADMIN_SECURE_TOKEN_REDIS_PREFIX: str = 'admin:token'
     COMPANY_SECURE_TOKEN_REDIS_PREFIX: str = 'company:token'
     TOKEN_REFRESH_REDIS_PREFIX: str = 'boilerplate:refresh_token'
+    TOKEN_INDEX_REDIS_PREFIX: str = 'boilerplate:token_index'  # Per-user sorted set of token keys
+    TOKEN_GENERATION_REDIS_PREFIX: str = 'boilerplate:token_generation'  # Per-user counter, bumped to revoke all tokens
+    TOKEN_VERIFY_CACHE_MAXSIZE: int = 10000
+    TOKEN_VERIFY_CACHE_EXPIRE_SECONDS: int = 5  # Verified tokens are trusted for this long without decoding
+    TOKEN_REVOKE_CHANNEL: str = 'boilerplate:token:revoke'  # Redis pub/sub channel for token revocations
     TOKEN_REQUEST_PATH_EXCLUDE: list[str] = [ # JWT / RBAC whitelisting
         f'/admin{FASTAPI_API_V1_PATH}/auth/login',
         f'/client{FASTAPI_API_V1_PATH}/auth/login',
@@ -107,6 +112,25 @@ class Settings(BaseSettings):
     JWT_COMPANY_REDIS_PREFIX: str = 'boilerplate:company'
     JWT_ADMIN_REDIS_PREFIX: str = 'boilerplate:admin'
     JWT_USER_REDIS_EXPIRE_SECONDS: int = 60 * 60 * 24 * 7
+    JWT_USER_CACHE_MAXSIZE: int = 10000  # In-process tier in front of the redis user cache
+    JWT_USER_CACHE_EXPIRE_SECONDS: int = 30
+    JWT_USER_LOAD_REDIS_LOCK: bool = False  # Let a single node repopulate a missing user cache for the whole cluster
+    JWT_USER_LOAD_LOCK_TIMEOUT_SECONDS: int = 10
+    JWT_USER_INVALIDATE_CHANNEL: str = 'boilerplate:user:invalidate'  # Redis pub/sub channel for user cache invalidations
+
+    # Password hashing
+    PASSWORD_HASH_EXECUTOR: Literal['thread', 'process'] = 'thread'  # bcrypt releases the GIL, threads are usually enough
+    PASSWORD_HASH_WORKERS: int = 4
+    PASSWORD_HASH_MAX_CONCURRENCY: int = 4  # Hashes handed to the executor at once, the rest wait on the event loop
+    PASSWORD_HASH_ROUNDS: int | None = None  # Fixed bcrypt cost, e.g. from `python seeder/run.py calibrate_password_hash`
+    PASSWORD_HASH_CALIBRATE: bool = False  # Calibrate the cost at startup when no fixed cost is set, once per deployment
+    PASSWORD_HASH_ROUNDS_REDIS_KEY: str = 'boilerplate:password_hash:rounds'  # Calibrated cost, delete it to recalibrate
+    PASSWORD_HASH_TARGET_MS: int = 50  # Target time per hash
+
+    # Pagination
+    PAGINATION_COUNT_REDIS_PREFIX: str = 'boilerplate:pagination:count'
+    PAGINATION_COUNT_CACHE_EXPIRE_SECONDS: int = 60  # Cached count strategy, a count is reused this long for the same filters
+    PAGINATION_EXACT_COUNT_THRESHOLD: int = 10000  # Estimated count strategy, smaller estimates are recounted exactly
 
     # Permission (RBAC)
     PERMISSION_MODE: Literal['casbin', 'role-menu'] = 'casbin'
@@ -114,6 +138,14 @@ class Settings(BaseSettings):
 
     # RBAC
     # Casbin
+    RBAC_CASBIN_POLICY_CHANNEL: str = 'boilerplate:casbin:policy'  # Redis pub/sub channel for policy reloads
+    RBAC_CASBIN_POLICY_VERSION_KEY: str = f'{PERMISSION_REDIS_PREFIX}:casbin:version'
+    # Decisions are cached per route template, policies should target templates rather than concrete paths
+    RBAC_DECISION_CACHE_MAXSIZE: int = 10000
+    RBAC_DECISION_CACHE_EXPIRE_SECONDS: int = 60 * 5
+    RBAC_SUBJECT_CACHE_MAXSIZE: int = 10000  # Users whose per-user rules are kept in memory
+    RBAC_CHECK_MAX_POLICIES: int = 100  # Permissions checked by a single /casbin/check call
+    RBAC_LOADED_SUBJECTS_MAXSIZE: int = 1000  # Non-role subjects kept in the shared enforcer for management
     RBAC_CASBIN_EXCLUDE: set[tuple[str, str]] = {
         ('POST', f'/admin{FASTAPI_API_V1_PATH}/auth/logout'),
         ('POST', f'/client{FASTAPI_API_V1_PATH}/auth/logout'),
@@ -191,6 +223,22 @@ class Settings(BaseSettings):
     IP_LOCATION_PARSE: Literal['online', 'offline', 'false'] = 'online'
     IP_LOCATION_REDIS_PREFIX: str = 'boilerplate:ip:location'
     IP_LOCATION_EXPIRE_SECONDS: int = 60 * 60 * 24 * 1  # expiration time in seconds
+    IP_LOCATION_CACHE_MAXSIZE: int = 10000  # In-process cache of offline lookups
+    IP_LOCATION_ONLINE_URL: str = 'http://ip-api.com/json/{ip}?lang=fr-FR'  # ip-api compatible, {ip} is substituted
+    IP_LOCATION_ONLINE_TIMEOUT: float = 3
+    IP_LOCATION_ONLINE_MAX_CONNECTIONS: int = 10
+    IP_LOCATION_ONLINE_MAX_PENDING: int = 100  # Background lookups in flight, ips beyond it are resolved by a later request
+    IP_LOCATION_FAILURE_EXPIRE_SECONDS: int = 60 * 5  # Failed lookups are cached this long
+
+    # User agent
+    USER_AGENT_CACHE_MAXSIZE: int = 1000  # In-process cache of parsed user agents
+
+    # Log partitions
+    LOG_PARTITION_MONTHS_AHEAD: int = 3  # Monthly partitions created ahead of time
+    LOG_PARTITION_DETACH_ONLY: bool = False  # Detach expired partitions (e.g. to archive them) instead of dropping them
+    LOG_PARTITION_MAINTENANCE_INTERVAL_SECONDS: int = 60 * 60 * 6
+    OPERA_LOG_RETENTION_MONTHS: int = 6  # Full months kept before the current one, 0 keeps everything
+    LOGIN_LOG_RETENTION_MONTHS: int = 12
 
     # Opera log
     OPERA_LOG_PATH_EXCLUDE: list[str] = [
@@ -209,6 +257,20 @@ class Settings(BaseSettings):
         'new_password',
         'confirm_password',
     ]
+    # Share of read requests logged when no rule matches, writes and failures (>= 400) are always logged
+    OPERA_LOG_SAMPLE_RATE: float = 1.0
+    OPERA_LOG_SLOW_THRESHOLD_MS: float | None = None  # Requests slower than this are logged regardless of sampling
+    # Per route rules, compiled once at startup, keyed by method ('*' for any) and full route template, e.g.
+    # {'method': 'GET', 'path': '/admin/api/v1/logs/opera', 'sample_rate': 0.01, 'slow_ms': 500}
+    # {'method': '*', 'path': '/client/api/v1/health', 'never': True}
+    # Optional keys: sample_rate, never, slow_ms (defaults from the settings above)
+    OPERA_LOG_RULES: list[dict] = []
+    OPERA_LOG_BODY_MAX_BYTES: int = 64 * 1024  # Request body kept for logging, larger bodies are marked as truncated
+    OPERA_LOG_QUEUE_MAXSIZE: int = 10000  # Records buffered in memory before producers are slowed down
+    OPERA_LOG_QUEUE_PUT_TIMEOUT_SECONDS: float = 0.1  # Wait for room this long, then drop the record
+    OPERA_LOG_BATCH_SIZE: int = 500
+    OPERA_LOG_FLUSH_INTERVAL_SECONDS: float = 1
+    OPERA_LOG_DRAIN_TIMEOUT_SECONDS: float = 10  # Time given to flush the buffer on shutdown
 
     GOOGLE_CLIENT_ID: str
     GOOGLE_SECRET_KEY: str
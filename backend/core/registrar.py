@@ -7,10 +7,15 @@ from fastapi_pagination import add_pagination
 from starlette.middleware.authentication import AuthenticationMiddleware
 
 from backend.utils.prometheus import PrometheusMiddleware
+from backend.app.admin.service.opera_log_service import opera_log_writer
+from backend.common.broadcast import broadcast
 from backend.common.exception.exception_handler import register_exception
 from backend.common.log import set_customize_logfile, setup_logging
+from backend.common.security.hasher import password_hasher
+from backend.common.security.rbac import rbac
 from backend.core.conf import settings
 from backend.core.path_conf import STATIC_DIR
+from backend.database.db_partition import log_partition_manager
 from backend.database.db_postgres import create_table
 from backend.database.db_redis import redis_client
 from backend.middleware.jwt_auth_middleware import JwtAuthMiddleware
@@ -18,6 +23,7 @@ from backend.middleware.opera_log_middleware import OperaLogMiddleware
 from backend.middleware.state_middleware import StateMiddleware
 from backend.middleware.i18n_middleware import I18nMiddleware
 from backend.utils.demo_site import demo_site
+from backend.utils.request_parse import close_http_client, get_xdb_searcher
 from backend.utils.health_check import ensure_unique_route_names, http_limit_callback
 from backend.utils.serializers import MsgSpecJSONResponse
 
@@ -27,12 +33,15 @@ from backend.utils.serializers import MsgSpecJSONResponse
 @asynccontextmanager
 async def register_init(app: FastAPI):
     """
-    Start initialization
+    Start initialization, the lifespan of the root app: Starlette does not run the lifespan
+    of mounted apps, so the apps built by register_app must not rely on their own
 
     :return:
     """
     # Creating Database Tables
     await create_table()
+    # Create the upcoming log partitions and drop the expired ones, then keep doing it periodically
+    await log_partition_manager.start()
     # Connecting to redis
     await redis_client.open()
     # Initialize limiter
@@ -41,9 +50,30 @@ async def register_init(app: FastAPI):
         prefix=settings.REQUEST_LIMITER_REDIS_PREFIX,
         http_callback=http_limit_callback,
     )
+    # Map the ip2region database once per worker
+    if settings.IP_LOCATION_PARSE == 'offline':
+        get_xdb_searcher()
+    # Apply the password hash cost
+    await password_hasher.setup()
+    # Load the casbin policy once per worker
+    await rbac.enforcer()
+    # Listen for cross-worker invalidations
+    await broadcast.start()
+    # Start the operation log writer
+    await opera_log_writer.start()
 
     yield
 
+    # Flush the buffered operation logs
+    await opera_log_writer.stop()
+    # Stop the log partition maintenance
+    await log_partition_manager.stop()
+    # Stop listening for invalidations
+    await broadcast.stop()
+    # Shut the password hashing executor down
+    password_hasher.shutdown()
+    # Close the ip location client
+    await close_http_client()
     # Closing a redis connection
     await redis_client.close()
     # Close limiter
@@ -64,7 +94,6 @@ def register_app(router: APIRouter, name: str = "Parse name" ) -> FastAPI:
         redoc_url=f"{settings.FASTAPI_REDOCS_URL}",
         openapi_url=f"{settings.FASTAPI_OPENAPI_URL}",
         default_response_class=MsgSpecJSONResponse,
-        lifespan=register_init,
     )
 
     # log (computing)
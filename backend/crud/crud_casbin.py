@@ -1,6 +1,6 @@
 from uuid import UUID
 
-from sqlalchemy import Select
+from sqlalchemy import Select, select
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.crud.crud_base import CRUDBase
 
@@ -19,6 +19,25 @@ class CRUDCasbin(CRUDBase[CasbinRule]):
         """
         return await self.select_order('id', 'desc', ptype=ptype, v0__like=f'%{sub}%')
 
+    async def get_rules(self, db: AsyncSession, ptype: str) -> list[list[str]]:
+        """
+        Get all casbin rules of a type, in the format returned by the enforcer
+
+        :param db:
+        :param ptype:
+        :return:
+        """
+        stmt = select(self.model).where(self.model.ptype == ptype).order_by(self.model.id)
+        rules = []
+        for line in (await db.execute(stmt)).scalars():
+            rule = []
+            for v in (line.v0, line.v1, line.v2, line.v3, line.v4, line.v5):
+                if v is None:
+                    break
+                rule.append(v)
+            rules.append(rule)
+        return rules
+
     async def delete_policies_by_sub(self, db: AsyncSession, sub: DeleteAllPoliciesParam) -> int:
         """
         Delete all P casbin policies for the role
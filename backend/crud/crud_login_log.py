@@ -1,4 +1,4 @@
-from sqlalchemy import Select
+from sqlalchemy import Select, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy_crud_plus import CRUDPlus
 
@@ -47,12 +47,14 @@ class CRUDLoginLog(CRUDPlus[LoginLog]):
 
     async def delete_all(self, db: AsyncSession) -> int:
         """
-        Delete all login logs
+        Delete all login logs, truncating the partitions instead of deleting row by row
 
         :param db:
-        :return:
+        :return: 1 if there were login logs to delete, else 0
         """
-        return await self.delete_model_by_column(db, allow_multiple=True)
+        exists = await db.scalar(select(self.model.id).limit(1))
+        await db.execute(text(f'TRUNCATE TABLE {self.model.__tablename__}'))
+        return int(exists is not None)
 
 
 login_log_dao: CRUDLoginLog = CRUDLoginLog(LoginLog)
@@ -1,4 +1,4 @@
-from sqlalchemy import Select
+from sqlalchemy import Select, insert, select, text
 from sqlalchemy.ext.asyncio import AsyncSession
 from backend.crud.crud_base import CRUDBase
 
@@ -35,6 +35,16 @@ class CRUDOperaLogDao(CRUDBase[OperaLog]):
         """
         await self.create_model(db, obj_in)
 
+    async def bulk_create(self, db: AsyncSession, objs_in: list[CreateOperaLogParam]) -> None:
+        """
+        Creating operation logs in a single multi-row insert
+
+        :param db:
+        :param objs_in:
+        :return:
+        """
+        await db.execute(insert(self.model), [obj_in.model_dump() for obj_in in objs_in])
+
     async def delete(self, db: AsyncSession, pk: list[int]) -> int:
         """
         Delete operation log
@@ -47,12 +57,14 @@ class CRUDOperaLogDao(CRUDBase[OperaLog]):
 
     async def delete_all(self, db: AsyncSession) -> int:
         """
-        Delete all operation logs
+        Delete all operation logs, truncating the partitions instead of deleting row by row
 
         :param db:
-        :return:
+        :return: 1 if there were operation logs to delete, else 0
         """
-        return await self.delete_model_by_column(db, allow_multiple=True)
+        exists = await db.scalar(select(self.model.id).limit(1))
+        await db.execute(text(f'TRUNCATE TABLE {self.model.__tablename__}'))
+        return int(exists is not None)
 
 
 opera_log_dao: CRUDOperaLogDao = CRUDOperaLogDao(OperaLog)
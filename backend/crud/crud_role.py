@@ -53,6 +53,18 @@ class CRUDRole(CRUDBase[Role]):
         roles = await db.execute(stmt)
         return roles.scalars().all()
 
+    async def get_user_x_ids(self, db, role_ids: list[int]) -> Sequence[str]:
+        """
+        Get the x_id of the users holding any of the roles
+
+        :param db:
+        :param role_ids:
+        :return:
+        """
+        stmt = select(User.x_id).join(User.roles).where(self.model.id.in_(role_ids)).distinct()
+        x_ids = await db.execute(stmt)
+        return x_ids.scalars().all()
+
     async def get_list(
         self, name: str = None, data_scope: int = None, status: int = None
     ) -> Select:
@@ -9,7 +9,7 @@ from backend.app.admin.schema.user import (
     UserRegister,
     UserUpdate
 )
-from backend.common.security.jwt import get_hash_password
+from backend.common.security.hasher import password_hasher
 from backend.common.enums import Role as Role_enum
 from backend.utils.timezone import timezone
 from backend.crud.crud_base import CRUDBase
@@ -87,7 +87,7 @@ class CRUDUser(CRUDBase[User]):
         """
         if not social:
             salt = text_captcha(5)
-            obj.password = get_hash_password(f'{obj.password}{salt}')
+            obj.password = await password_hasher.hash(f'{obj.password}{salt}')
             dict_obj = obj.model_dump()
             dict_obj.update({'salt': salt})
         else:
@@ -106,7 +106,7 @@ class CRUDUser(CRUDBase[User]):
         :return:
         """
         salt = text_captcha(5)
-        obj.password = get_hash_password(f'{obj.password}{salt}')
+        obj.password = await password_hasher.hash(f'{obj.password}{salt}')
         dict_obj = obj.model_dump(exclude={'roles'})
         
         dict_obj.update({'salt': salt})
@@ -0,0 +1,221 @@
+import asyncio
+import re
+
+from datetime import UTC, date, datetime
+
+from sqlalchemy import Table, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from backend.common.log import log
+from backend.core.conf import settings
+from backend.database.db_postgres import async_engine
+from backend.models.login_log import LoginLog
+from backend.models.opera_log import OperaLog
+
+
+def _add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+class LogPartitionManager:
+    """
+    Maintains the monthly range partitions of the log tables
+
+    Upcoming partitions are created ahead of time and expired ones are dropped (or detached) whole,
+    so retention never deletes row by row
+    """
+
+    def __init__(self, tables: dict[Table, int]):
+        """
+        :param tables: Partitioned table -> retention in months, 0 keeps everything
+        """
+        self.tables = tables
+        self._task: asyncio.Task | None = None
+
+    @staticmethod
+    def partition_name(table: str, month: date) -> str:
+        return f'{table}_p{month.year:04d}{month.month:02d}'
+
+    @staticmethod
+    def partition_key(table: Table) -> str:
+        return re.fullmatch(r'RANGE \((\w+)\)', table.dialect_options['postgresql']['partition_by']).group(1)
+
+    @staticmethod
+    async def _lock(conn: AsyncConnection) -> None:
+        # Serialize concurrent workers, the DDL below is not safe to race
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('log_partition_maintenance'))"))
+
+    @staticmethod
+    async def _relkind(conn: AsyncConnection, name: str) -> str | None:
+        # 'r' for a plain table, 'p' for a partitioned one, None when absent
+        return (
+            await conn.execute(text('SELECT relkind FROM pg_class WHERE oid = to_regclass(:name)'), {'name': name})
+        ).scalar()
+
+    async def partition_tables(self) -> None:
+        """
+        Convert the log tables still stored as plain tables, absent and already partitioned tables are left alone
+
+        :return:
+        """
+        async with async_engine.begin() as conn:
+            await self._lock(conn)
+            for table in self.tables:
+                if await self._relkind(conn, table.name) == 'r':
+                    await self._partition_table(conn, table)
+
+    async def _partition_table(self, conn: AsyncConnection, table: Table) -> None:
+        name, key, old = table.name, self.partition_key(table), f'{table.name}_unpartitioned'
+
+        # Free every name the partitioned table is created with
+        await conn.execute(text(f'ALTER TABLE {name} RENAME TO {old}'))
+        pkey = (
+            await conn.execute(
+                text("SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(:old) AND contype = 'p'"),
+                {'old': old},
+            )
+        ).scalar()
+        if pkey:
+            await conn.execute(text(f'ALTER TABLE {old} RENAME CONSTRAINT {pkey} TO {old}_pkey'))
+        indexes = await conn.execute(
+            text('SELECT indexrelid::regclass::text FROM pg_index WHERE indrelid = to_regclass(:old) AND NOT indisprimary'),
+            {'old': old},
+        )
+        for (index,) in indexes.all():
+            await conn.execute(text(f'DROP INDEX {index}'))
+        sequence = (await conn.execute(text("SELECT pg_get_serial_sequence(:old, 'id')"), {'old': old})).scalar()
+        if sequence:
+            await conn.execute(text(f'ALTER SEQUENCE {sequence} RENAME TO {old}_id_seq'))
+
+        await conn.run_sync(table.create)
+        first = (await conn.execute(text(f'SELECT min({key}) FROM {old}'))).scalar()
+        current = datetime.now(UTC).date().replace(day=1)
+        await self._create_partitions(conn, table, first.date().replace(day=1) if first else current, current)
+
+        columns = ', '.join(column.name for column in table.columns)
+        await conn.execute(text(f'INSERT INTO {name} ({columns}) SELECT {columns} FROM {old}'))
+        await conn.execute(
+            text(f"SELECT setval(pg_get_serial_sequence('{name}', 'id'), coalesce(max(id), 0) + 1, false) FROM {name}")
+        )
+        await conn.execute(text(f'DROP TABLE {old}'))
+        log.info(f'Log table {name} converted to monthly partitions on {key}')
+
+    async def maintain(self) -> None:
+        """
+        Create the upcoming partitions and drop the expired ones
+
+        :return:
+        """
+        async with async_engine.begin() as conn:
+            await self._lock(conn)
+            current = datetime.now(UTC).date().replace(day=1)
+            for table, retention_months in self.tables.items():
+                if await self._relkind(conn, table.name) != 'p':
+                    log.warning(
+                        f'Log table {table.name} is not partitioned, skipping its maintenance '
+                        '(run `python3 -m seeder.run partition-log-tables`)'
+                    )
+                    continue
+                await self._create_partitions(conn, table, current, current)
+                if retention_months > 0:
+                    await self._drop_partitions(conn, table.name, _add_months(current, -retention_months))
+
+    async def _create_partitions(self, conn: AsyncConnection, table: Table, first: date, current: date) -> None:
+        name, key = table.name, self.partition_key(table)
+        default = f'{name}_default'
+        await conn.execute(text(f'CREATE TABLE IF NOT EXISTS {default} PARTITION OF {name} DEFAULT'))
+        month = first
+        while month <= _add_months(current, settings.LOG_PARTITION_MONTHS_AHEAD):
+            partition, lower, upper = self.partition_name(name, month), month, _add_months(month, 1)
+            month = upper
+            if await self._relkind(conn, partition) is not None:
+                continue
+            bounds = f"{key} >= '{lower.isoformat()}' AND {key} < '{upper.isoformat()}'"
+            try:
+                async with conn.begin_nested():
+                    # Rows of that month already in the default partition would make the creation fail,
+                    # they are moved into the new partition instead
+                    stranded = (await conn.execute(text(f'SELECT 1 FROM {default} WHERE {bounds} LIMIT 1'))).first()
+                    if stranded:
+                        await conn.execute(text(f'ALTER TABLE {name} DETACH PARTITION {default}'))
+                    await conn.execute(
+                        text(
+                            f'CREATE TABLE {partition} PARTITION OF {name} '
+                            f"FOR VALUES FROM ('{lower.isoformat()}') TO ('{upper.isoformat()}')"
+                        )
+                    )
+                    if stranded:
+                        await conn.execute(text(f'INSERT INTO {name} SELECT * FROM {default} WHERE {bounds}'))
+                        await conn.execute(text(f'DELETE FROM {default} WHERE {bounds}'))
+                        await conn.execute(text(f'ALTER TABLE {name} ATTACH PARTITION {default} DEFAULT'))
+            except Exception as e:
+                log.error(f'Failed to create log partition {partition}: {e}')
+
+    async def _drop_partitions(self, conn: AsyncConnection, table: str, cutoff: date) -> None:
+        result = await conn.execute(
+            text(
+                'SELECT c.relname FROM pg_inherits i '
+                'JOIN pg_class c ON c.oid = i.inhrelid '
+                'JOIN pg_class p ON p.oid = i.inhparent '
+                'WHERE p.relname = :table'
+            ),
+            {'table': table},
+        )
+        pattern = re.compile(rf'^{re.escape(table)}_p(\d{{4}})(\d{{2}})$')
+        for (name,) in result.all():
+            match = pattern.match(name)
+            if not match:
+                continue
+            month = date(int(match.group(1)), int(match.group(2)), 1)
+            if _add_months(month, 1) > cutoff:
+                continue
+            await conn.execute(text(f'ALTER TABLE {table} DETACH PARTITION {name}'))
+            if not settings.LOG_PARTITION_DETACH_ONLY:
+                await conn.execute(text(f'DROP TABLE {name}'))
+            log.info(f'Expired log partition {name} {"detached" if settings.LOG_PARTITION_DETACH_ONLY else "dropped"}')
+
+    async def start(self) -> None:
+        """
+        Run the maintenance now, then periodically
+
+        :return:
+        """
+        try:
+            await self.maintain()
+        except Exception as e:
+            # The logs keep going to whatever partition exists, the periodic run retries
+            log.error(f'Log partition maintenance failure: {e}')
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """
+        Stop the periodic maintenance
+
+        :return:
+        """
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(settings.LOG_PARTITION_MAINTENANCE_INTERVAL_SECONDS)
+            try:
+                await self.maintain()
+            except Exception as e:
+                log.error(f'Log partition maintenance failure: {e}')
+
+
+# Create a log partition manager instance
+log_partition_manager = LogPartitionManager(
+    {
+        OperaLog.__table__: settings.OPERA_LOG_RETENTION_MONTHS,
+        LoginLog.__table__: settings.LOGIN_LOG_RETENTION_MONTHS,
+    }
+)
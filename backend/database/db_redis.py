@@ -1,4 +1,5 @@
 import sys
+import time
 
 from redis.asyncio import Redis
 from redis.exceptions import AuthenticationError, TimeoutError
@@ -6,8 +7,42 @@ from redis.exceptions import AuthenticationError, TimeoutError
 from backend.common.log import log
 from backend.core.conf import settings
 
+# KEYS: old refresh key, generation key, token index key, old access key, new access key, new refresh key,
+#       then the indexed keys to drop (non multi login); every key touched is declared
+# ARGV: old refresh token, expected generation, new access token, access ttl, new refresh token, refresh ttl,
+#       now, index ttl, revoke channel, revoke message, index size seen when listing the keys to drop (-1 if none)
+_ROTATE_TOKENS_LUA = """
+if redis.call('GET', KEYS[1]) ~= ARGV[1] then
+    return 0
+end
+if tonumber(redis.call('GET', KEYS[2]) or '0') ~= tonumber(ARGV[2]) then
+    return 0
+end
+if tonumber(ARGV[11]) >= 0 and redis.call('ZCARD', KEYS[3]) ~= tonumber(ARGV[11]) then
+    -- A token was indexed or dropped since the keys were listed
+    return -1
+end
+local now = tonumber(ARGV[7])
+for i = 7, #KEYS do
+    redis.call('DEL', KEYS[i])
+    redis.call('ZREM', KEYS[3], KEYS[i])
+end
+redis.call('DEL', KEYS[1], KEYS[4])
+redis.call('ZREM', KEYS[3], KEYS[1], KEYS[4])
+redis.call('SETEX', KEYS[5], ARGV[4], ARGV[3])
+redis.call('SETEX', KEYS[6], ARGV[6], ARGV[5])
+redis.call('ZADD', KEYS[3], now + tonumber(ARGV[4]), KEYS[5], now + tonumber(ARGV[6]), KEYS[6])
+redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', now)
+redis.call('EXPIRE', KEYS[3], ARGV[8])
+redis.call('PUBLISH', ARGV[9], ARGV[10])
+return 1
+"""
+
 
 class RedisCli(Redis):
+    # Rotations retried when the token index changes between listing and rotating
+    _ROTATE_TOKENS_ATTEMPTS = 3
+
     def __init__(self):
         super(RedisCli, self).__init__(
             host=settings.REDIS_HOST,
@@ -17,6 +52,7 @@ class RedisCli(Redis):
             socket_timeout=settings.REDIS_TIMEOUT,
             decode_responses=True,   # Transcoding utf-8
         )
+        self._rotate_tokens_script = self.register_script(_ROTATE_TOKENS_LUA)
 
     async def open(self):
         """
@@ -36,6 +72,115 @@ class RedisCli(Redis):
             log.error('❌ Database redis connection exception {}', e)
             sys.exit()
 
+    async def get_token_and_user(
+        self, token_key: str, generation_key: str, user_key: str
+    ) -> tuple[str | None, str | None, str | None]:
+        """
+        Get the token validity key, the user token generation and the cached user in a single round trip
+
+        :param token_key:
+        :param generation_key:
+        :param user_key:
+        :return:
+        """
+        token, generation, user = await self.mget(token_key, generation_key, user_key)
+        return token, generation, user
+
+    async def add_user_token(self, index_key: str, key: str, value: str, expire_seconds: int) -> None:
+        """
+        Store a token key and track it in the per-user token index, pruning expired entries
+
+        :param index_key: Per-user sorted set of token keys, scored by expiration timestamp
+        :param key:
+        :param value:
+        :param expire_seconds:
+        :return:
+        """
+        now = time.time()
+        async with self.pipeline(transaction=True) as pipe:
+            pipe.setex(key, expire_seconds, value)
+            pipe.zadd(index_key, {key: now + expire_seconds})
+            pipe.zremrangebyscore(index_key, '-inf', now)
+            # The index lives as long as the longest lived token it may hold
+            pipe.expire(index_key, max(expire_seconds, settings.TOKEN_REFRESH_EXPIRE_SECONDS))
+            await pipe.execute()
+
+    async def delete_user_tokens(self, index_key: str, prefix: str | None = None) -> None:
+        """
+        Delete the token keys tracked in a per-user token index, O(sessions) instead of a keyspace SCAN
+
+        :param index_key:
+        :param prefix: Only delete the keys with this prefix
+        :return:
+        """
+        keys = await self.zrange(index_key, 0, -1)
+        if prefix is not None:
+            keys = [key for key in keys if key.startswith(prefix)]
+        if keys:
+            async with self.pipeline(transaction=True) as pipe:
+                pipe.delete(*keys)
+                pipe.zrem(index_key, *keys)
+                await pipe.execute()
+
+    async def rotate_user_tokens(
+        self,
+        *,
+        index_key: str,
+        generation_key: str,
+        refresh_key: str,
+        refresh_token: str,
+        generation: int,
+        access_key: str,
+        new_access: tuple[str, str, int],
+        new_refresh: tuple[str, str, int],
+        delete_prefixes: list[str],
+        revoke_channel: str,
+        revoke_message: str,
+    ) -> bool:
+        """
+        Atomically swap a refresh token for a new access / refresh token pair in one round trip
+
+        :param index_key: Per-user token index
+        :param generation_key: Per-user token generation
+        :param refresh_key: Key of the refresh token being used
+        :param refresh_token: The refresh token being used, must still be stored under refresh_key
+        :param generation: Generation of the refresh token, must still be current
+        :param access_key: Key of the access token being replaced
+        :param new_access: key, token, expire seconds
+        :param new_refresh: key, token, expire seconds
+        :param delete_prefixes: Indexed keys to delete with these prefixes, e.g. the other sessions
+        :param revoke_channel: Channel notified once the old tokens are deleted
+        :param revoke_message:
+        :return: False when the refresh token was already used or revoked
+        """
+        for _ in range(self._ROTATE_TOKENS_ATTEMPTS):
+            # The keys to drop are listed here, the script only touches the keys it is given
+            delete_keys, index_size = [], -1
+            if delete_prefixes:
+                indexed = await self.zrange(index_key, 0, -1)
+                delete_keys = [key for key in indexed if key.startswith(tuple(delete_prefixes))]
+                index_size = len(indexed)
+            rotated = await self._rotate_tokens_script(
+                keys=[refresh_key, generation_key, index_key, access_key, new_access[0], new_refresh[0], *delete_keys],
+                args=[
+                    refresh_token,
+                    generation,
+                    new_access[1],
+                    new_access[2],
+                    new_refresh[1],
+                    new_refresh[2],
+                    time.time(),
+                    max(new_access[2], new_refresh[2], settings.TOKEN_REFRESH_EXPIRE_SECONDS),
+                    revoke_channel,
+                    revoke_message,
+                    index_size,
+                ],
+            )
+            if rotated != -1:
+                return bool(rotated)
+        log.warning(f'Token index {index_key} kept changing, refresh token rotation abandoned')
+        return False
+
     async def delete_prefix(self, prefix: str, exclude: str | list = None):
         """
         Delete all keys with the specified prefix
@@ -10,6 +10,8 @@ cd backend
 # Appliquer les migrations de la base de données
 poetry run alembic revision --autogenerate
 poetry run alembic upgrade heads
+# Partitionner les tables de logs encore non partitionnées (sans effet sinon)
+poetry run python3 -m seeder.run partition-log-tables
 # cd ..
 
 # Démarrer l'application FastAPI avec Uvicorn sans le reloader
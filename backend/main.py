@@ -10,12 +10,12 @@ import uvicorn
 from opentelemetry.propagate import inject
 
 from backend.core.conf import settings
-from backend.core.registrar import register_app
+from backend.core.registrar import register_app, register_init
 from backend.app.api import (admin_router)
 from backend.utils.prometheus import EndpointFilter, setting_otlp
 
 
-app = FastAPI()
+app = FastAPI(lifespan=register_init)
 
 setting_otlp(app, settings.APP_NAME, settings.OTLP_GRPC_ENDPOINT)
 logging.getLogger("uvicorn.access").addFilter(EndpointFilter())
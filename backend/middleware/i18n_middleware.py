@@ -1,11 +1,19 @@
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
 from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 
-class I18nMiddleware(BaseHTTPMiddleware):
+class I18nMiddleware:
     WHITE_LIST = ['en', 'fr']
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint):
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
         # 1. headers 2. path 3. query string
         locale = request.headers.get('locale', None) or \
                  request.path_params.get('locale', None) or \
@@ -16,4 +24,4 @@ class I18nMiddleware(BaseHTTPMiddleware):
             locale = 'fr'
         request.state.locale = locale
 
-        return await call_next(request)
+        await self.app(scope, receive, send)
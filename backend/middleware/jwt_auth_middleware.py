@@ -14,6 +14,7 @@ from backend.core.conf import settings
 from backend.database.db_postgres import async_db_session
 from backend.database.db_redis import redis_client
 from backend.utils.serializers import MsgSpecJSONResponse, select_as_dict
+from backend.utils.single_flight import SingleFlight
 
 
 class _AuthenticationError(AuthenticationError):
@@ -28,6 +29,9 @@ class _AuthenticationError(AuthenticationError):
 class JwtAuthMiddleware(AuthenticationBackend):
     """JWT Authentication Middleware"""
 
+    # Concurrent user cache misses for the same sub share one database load
+    _user_loads: SingleFlight[CurrentUserIns] = SingleFlight()
+
     @staticmethod
     def auth_exception_handler(conn: HTTPConnection, exc: _AuthenticationError) -> Response:
         """Override internal authentication error handling"""
@@ -46,21 +50,19 @@ class JwtAuthMiddleware(AuthenticationBackend):
             return
 
         try:
-            sub = await jwt.jwt_authentication(token)
-            cache_user = await redis_client.get(f'{settings.JWT_USER_REDIS_PREFIX}:{sub}')
-            if not cache_user:
-                async with async_db_session() as db:
-                    current_user = await jwt.get_current_user(db, sub)
-                    user = CurrentUserIns(**select_as_dict(current_user))
-                    await redis_client.setex(
-                        f'{settings.JWT_USER_REDIS_PREFIX}:{sub}',
-                        settings.JWT_USER_REDIS_EXPIRE_SECONDS,
-                        user.model_dump_json(),
-                    )
-            else:
-                # TODO: it should be replaced with the use of model_validate_json
-                # https://docs.pydantic.dev/latest/concepts/json/#partial-json-parsing
-                user = CurrentUserIns.model_validate(from_json(cache_user, allow_partial=True))
+            sub = jwt.cached_jwt_authentication(token)
+            user = jwt.user_cache.get(sub) if sub else None
+            if user is None:
+                if sub is None:
+                    # Token validity and cached user in a single redis round trip
+                    sub, cache_user = await jwt.jwt_authentication_with_user(token)
+                else:
+                    cache_user = await redis_client.get(f'{settings.JWT_USER_REDIS_PREFIX}:{sub}')
+                if not cache_user:
+                    user = await self._user_loads.do(sub, lambda: self.load_user(sub))
+                else:
+                    user = self.parse_user(cache_user)
+                jwt.user_cache.set(sub, user)
         except TokenError as exc:
             raise _AuthenticationError(code=exc.code, msg=exc.detail, headers=exc.headers)
         except Exception as e:
@@ -71,3 +73,34 @@ class JwtAuthMiddleware(AuthenticationBackend):
         # For standard return modes see: https://www.starlette.io/authentication/
         return AuthCredentials(['authenticated']), user
 
+    @staticmethod
+    def parse_user(cache_user: str) -> CurrentUserIns:
+        # TODO: it should be replaced with the use of model_validate_json
+        # https://docs.pydantic.dev/latest/concepts/json/#partial-json-parsing
+        return CurrentUserIns.model_validate(from_json(cache_user, allow_partial=True))
+
+    async def load_user(self, sub: str) -> CurrentUserIns:
+        """
+        Load the current user from the database and repopulate the redis cache
+
+        :param sub:
+        :return:
+        """
+        key = f'{settings.JWT_USER_REDIS_PREFIX}:{sub}'
+        if settings.JWT_USER_LOAD_REDIS_LOCK:
+            async with redis_client.lock(f'{key}:lock', timeout=settings.JWT_USER_LOAD_LOCK_TIMEOUT_SECONDS):
+                # Another node may have repopulated the cache while we were waiting
+                cache_user = await redis_client.get(key)
+                if cache_user:
+                    return self.parse_user(cache_user)
+                return await self._load_user(sub)
+        return await self._load_user(sub)
+
+    @staticmethod
+    async def _load_user(sub: str) -> CurrentUserIns:
+        key = f'{settings.JWT_USER_REDIS_PREFIX}:{sub}'
+        async with async_db_session() as db:
+            current_user = await jwt.get_current_user(db, sub)
+            user = CurrentUserIns(**select_as_dict(current_user))
+        await redis_client.setex(key, settings.JWT_USER_REDIS_EXPIRE_SECONDS, user.model_dump_json())
+        return user
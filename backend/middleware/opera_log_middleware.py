@@ -1,70 +1,346 @@
-from asyncio import create_task
+import json
+import random
+import re
+
+from dataclasses import dataclass
 from datetime import datetime
+from typing import Any, Callable
+from urllib.parse import parse_qsl
 
-from asgiref.sync import sync_to_async
-from fastapi import Response
-from starlette.datastructures import UploadFile
-from starlette.middleware.base import BaseHTTPMiddleware
+from python_multipart import MultipartParser
+from python_multipart.multipart import parse_options_header
 from starlette.requests import Request
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from backend.app.admin.schema.opera_log import CreateOperaLogParam
-from backend.app.admin.service.opera_log_service import OperaLogService
+from backend.app.admin.service.opera_log_service import opera_log_writer
 from backend.common.dataclasses import RequestCallNext
 from backend.common.enums import OperaLogCipherType, StatusType
 from backend.common.log import log
 from backend.core.conf import settings
-from backend.utils.encrypt import AESCipher, ItsDCipher, Md5Cipher
+from backend.utils.encrypt import ItsDCipher, Md5Cipher, desensitize
 from backend.utils.trace_id import get_request_trace_id
 
 
-class OperaLogMiddleware(BaseHTTPMiddleware):
+# Read-only methods, the only ones the rules can sample out
+_SAMPLED_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+
+
+@dataclass(frozen=True, slots=True)
+class OperaLogRule:
+    sample_rate: float = settings.OPERA_LOG_SAMPLE_RATE
+    never: bool = False
+    slow_ms: float | None = settings.OPERA_LOG_SLOW_THRESHOLD_MS
+
+    def should_log(self, method: str, status_code: int | None, cost_time: float) -> bool:
+        """
+        Whether a finished request is logged, failed and writing requests are always logged
+
+        :param method: Request method
+        :param status_code: Response status, None if the application raised
+        :param cost_time: Request elapsed time (ms)
+        :return:
+        """
+        if status_code is None or status_code >= 400 or method not in _SAMPLED_METHODS:
+            return True
+        if self.never:
+            return False
+        if self.slow_ms is not None and cost_time >= self.slow_ms:
+            return True
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+
+class OperaLogRules:
+    """OPERA_LOG_RULES compiled into a (method, route template) lookup"""
+
+    def __init__(self, rules: list[dict]):
+        self.default = OperaLogRule()
+        self._rules: dict[tuple[str, str], OperaLogRule] = {}
+        for rule in rules:
+            rule = dict(rule)
+            method = rule.pop('method', '*').upper()
+            path = rule.pop('path')
+            self._rules[(method, path)] = OperaLogRule(**rule)
+
+    def match(self, method: str, template: str | None) -> OperaLogRule:
+        """
+        Get the rule of a route, method specific rules take precedence
+
+        :param method:
+        :param template: Full route template, None when no route matched
+        :return:
+        """
+        if template is None or not self._rules:
+            return self.default
+        return self._rules.get((method, template)) or self._rules.get(('*', template)) or self.default
+
+
+class _MultipartFields:
+    """
+    Streams a multipart/form-data body, keeping the non-file fields (at most max_bytes of them)
+    and only the name of the uploaded files
+    """
+
+    def __init__(self, content_type: str, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.fields: dict[str, str] = {}
+        self.size = 0
+        self.truncated = False
+        self.invalid = False
+        self._header_name = b''
+        self._header_value = b''
+        self._disposition = b''
+        self._name: str | None = None
+        self._filename: str | None = None
+        self._data = bytearray()
+        boundary = parse_options_header(content_type)[1].get(b'boundary')
+        self._parser = (
+            MultipartParser(
+                boundary,
+                {
+                    'on_part_begin': self._on_part_begin,
+                    'on_header_field': self._on_header_field,
+                    'on_header_value': self._on_header_value,
+                    'on_header_end': self._on_header_end,
+                    'on_headers_finished': self._on_headers_finished,
+                    'on_part_data': self._on_part_data,
+                    'on_part_end': self._on_part_end,
+                },
+            )
+            if boundary
+            else None
+        )
+        self.invalid = self._parser is None
+
+    def write(self, chunk: bytes) -> None:
+        if self._parser is None:
+            return
+        try:
+            self._parser.write(chunk)
+        except Exception:
+            self.invalid = True
+            self._parser = None
+
+    def _on_part_begin(self) -> None:
+        self._disposition = b''
+        self._name = None
+        self._filename = None
+        self._data = bytearray()
+
+    def _on_header_field(self, data: bytes, start: int, end: int) -> None:
+        self._header_name += data[start:end]
+
+    def _on_header_value(self, data: bytes, start: int, end: int) -> None:
+        self._header_value += data[start:end]
+
+    def _on_header_end(self) -> None:
+        if self._header_name.lower() == b'content-disposition':
+            self._disposition = self._header_value
+        self._header_name = b''
+        self._header_value = b''
+
+    def _on_headers_finished(self) -> None:
+        options = parse_options_header(self._disposition)[1]
+        if b'name' in options:
+            self._name = options[b'name'].decode('utf-8', 'replace')
+        if b'filename' in options:
+            self._filename = options[b'filename'].decode('utf-8', 'replace')
+
+    def _on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self._filename is not None:
+            # File contents are never kept
+            return
+        room = self.max_bytes - self.size
+        chunk = data[start:end]
+        if len(chunk) > room:
+            chunk = chunk[:room]
+            self.truncated = True
+        self._data += chunk
+        self.size += len(chunk)
+
+    def _on_part_end(self) -> None:
+        if self._name is not None:
+            self.fields[self._name] = (
+                self._filename if self._filename is not None else self._data.decode('utf-8', 'replace')
+            )
+
+
+def _redact(prefix: str, keys: frozenset[str]) -> str:
+    """Mask the values of sensitive keys in a JSON or urlencoded body prefix that could not be parsed"""
+    for key in keys:
+        escaped = re.escape(key)
+        prefix = re.sub(rf'("{escaped}"\s*:\s*)("(?:[^"\\]|\\.)*"?|[^,}}\]]*)', r'\1"******"', prefix)
+        prefix = re.sub(rf'((?:^|&){escaped}=)[^&]*', r'\1******', prefix)
+    return prefix
+
+
+class BodyCapture:
+    """
+    Tees the ASGI receive stream, keeping at most max_bytes of a JSON, urlencoded or multipart body
+
+    Other bodies (binary content) and the contents of uploaded files are passed through without being kept
+    """
+
+    __slots__ = ('_receive', 'media_type', 'capture', 'multipart', 'max_bytes', 'redact_keys', 'body', 'size', 'truncated')
+
+    def __init__(self, receive: Receive, content_type: str | None, max_bytes: int, redact_keys: frozenset[str]):
+        """
+        :param receive:
+        :param content_type:
+        :param max_bytes:
+        :param redact_keys: Keys masked in the kept prefix of a truncated body
+        """
+        self._receive = receive
+        self.media_type = (content_type or '').split(';', 1)[0].strip().lower()
+        self.capture = (
+            self.media_type in ('application/json', 'application/x-www-form-urlencoded')
+            or self.media_type.endswith('+json')
+        )
+        self.multipart = (
+            _MultipartFields(content_type, max_bytes) if self.media_type == 'multipart/form-data' else None
+        )
+        self.max_bytes = max_bytes
+        self.redact_keys = redact_keys
+        self.body = bytearray()
+        self.size = 0
+        self.truncated = False
+
+    async def __call__(self) -> Message:
+        message = await self._receive()
+        if message['type'] == 'http.request':
+            chunk = message.get('body', b'')
+            self.size += len(chunk)
+            if self.multipart is not None:
+                self.multipart.write(chunk)
+            elif self.capture and not self.truncated:
+                room = self.max_bytes - len(self.body)
+                if len(chunk) > room:
+                    self.body += chunk[:room]
+                    self.truncated = True
+                else:
+                    self.body += chunk
+        return message
+
+    def args(self) -> dict:
+        """
+        The captured body as log arguments
+
+        :return:
+        """
+        if not self.size:
+            return {}
+        if self.multipart is not None:
+            if self.multipart.invalid:
+                return {'__body_invalid__': self.size}
+            args = dict(self.multipart.fields)
+            if self.multipart.truncated:
+                args['__body_truncated__'] = self.size
+            return args
+        if not self.capture:
+            return {'__body_skipped__': self.media_type or 'unknown'}
+        if self.truncated:
+            prefix = _redact(self.body.decode('utf-8', 'replace'), self.redact_keys)
+            return {'__body_truncated__': self.size, '__body_prefix__': prefix}
+        try:
+            if self.media_type == 'application/x-www-form-urlencoded':
+                return dict(parse_qsl(self.body.decode('latin-1'), keep_blank_values=True))
+            json_data = json.loads(self.body)
+        except ValueError:
+            return {'__body_invalid__': self.size}
+        if not isinstance(json_data, dict):
+            json_data = {f'{type(json_data)}_to_dict_data': json_data}
+        return json_data
+
+
+class OperaLogMiddleware:
     """Operation Logging Middleware"""
 
-    async def dispatch(self, request: Request, call_next) -> Response:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+        self.rules = OperaLogRules(settings.OPERA_LOG_RULES)
+        self.encrypt_keys = frozenset(settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE)
+        self.encrypt = self.get_encrypt()
+        # A truncated body cannot be desensitized key by key, its sensitive values are masked instead
+        self.redact_keys = (
+            frozenset() if settings.OPERA_LOG_ENCRYPT_TYPE == OperaLogCipherType.plan else self.encrypt_keys
+        )
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
         # Whitelisting of excluded records
+        request = Request(scope)
         path = request.url.path
         if path in settings.OPERA_LOG_PATH_EXCLUDE or not path.startswith((
             f'/client{settings.FASTAPI_API_V1_PATH}', 
             f'/admin{settings.FASTAPI_API_V1_PATH}', 
             f'/company{settings.FASTAPI_API_V1_PATH}',
             f'/mentor{settings.FASTAPI_API_V1_PATH}')):
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
 
         # request resolution
         try:
             # This information is dependent on the jwt middleware
             user_email = request.user.email
-        except AttributeError:
+        except (AttributeError, AssertionError):
             user_email = None
         method = request.method
-        args = await self.get_request_args(request)
-        args = await self.desensitization(args)
 
-        # execute a request
+        # execute a request, the body is captured as the application reads it
+        body_capture = BodyCapture(
+            receive, request.headers.get('content-type'), settings.OPERA_LOG_BODY_MAX_BYTES, self.redact_keys
+        )
+        status_code = None
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message['type'] == 'http.response.start':
+                status_code = message['status']
+            await send(message)
+
         start_time = datetime.now()
-        request_next = await self.execute_request(request, call_next)
+        request_next = await self.execute_request(request, body_capture, send_wrapper)
         end_time = datetime.now()
         cost_time = (end_time - start_time).total_seconds() * 1000.0
 
-        # This information can only be obtained after a request
+        # Sampling and routing rules, decided once the route and the outcome are known
         _route = request.scope.get('route')
+        template = f'{request.scope.get("root_path", "")}{_route.path}' if _route else None
+        if not self.rules.match(method, template).should_log(
+            method, None if request_next.err else status_code, cost_time
+        ):
+            if request_next.err:
+                raise request_next.err from None
+            return
+
+        # Path parameters are only known once the request was routed
+        args = self.get_request_args(request, body_capture)
+        args = self.desensitization(args)
+
+        # This information can only be obtained after a request
         summary = getattr(_route, 'summary', None) or ''
 
         # Log Creation
+        context = request.state.context
+        ip_info = await context.ip_info()
+        ua_info = context.ua_info
         opera_log_in = CreateOperaLogParam(
             trace_id=get_request_trace_id(request),
             user_email=user_email,
             method=method,
             title=summary,
             path=path,
-            ip=request.state.ip,
-            country=request.state.country,
-            region=request.state.region,
-            city=request.state.city,
-            user_agent=request.state.user_agent,
-            os=request.state.os,
-            browser=request.state.browser,
-            device=request.state.device,
+            ip=ip_info.ip,
+            country=ip_info.country,
+            region=ip_info.region,
+            city=ip_info.city,
+            user_agent=ua_info.user_agent,
+            os=ua_info.os,
+            browser=ua_info.browser,
+            device=ua_info.device,
             args=args,
             status=request_next.status,
             code=request_next.code,
@@ -72,24 +348,21 @@ class OperaLogMiddleware(BaseHTTPMiddleware):
             cost_time=cost_time,
             opera_time=start_time,
         )
-        create_task(OperaLogService.create(obj_in=opera_log_in))  # noqa: ignore
+        await opera_log_writer.put(opera_log_in)
 
         # error throwing
         err = request_next.err
         if err:
             raise err from None
 
-        return request_next.response
-
-    async def execute_request(self, request: Request, call_next) -> RequestCallNext:
+    async def execute_request(self, request: Request, receive: Receive, send: Send) -> RequestCallNext:
         """execute a request"""
         code = 200
         msg = 'Success'
         status = StatusType.enable
         err = None
-        response = None
         try:
-            response = await call_next(request)
+            await self.app(request.scope, receive, send)
             code, msg = self.request_exception_handler(request, code, msg)
         except Exception as e:
             log.error(f'Request Exception: {e}')
@@ -99,7 +372,7 @@ class OperaLogMiddleware(BaseHTTPMiddleware):
             status = StatusType.disable
             err = e
 
-        return RequestCallNext(code=str(code), msg=msg, status=status, err=err, response=response)
+        return RequestCallNext(code=str(code), msg=msg, status=status, err=err, response=None)
 
     @staticmethod
     def request_exception_handler(request: Request, code: int, msg: str) -> tuple[str, str]:
@@ -123,31 +396,14 @@ class OperaLogMiddleware(BaseHTTPMiddleware):
         return code, msg
 
     @staticmethod
-    async def get_request_args(request: Request) -> dict:
-        """Request Exception"""
+    def get_request_args(request: Request, body_capture: BodyCapture) -> dict:
+        """Request Arguments"""
         args = dict(request.query_params)
         args.update(request.path_params)
-        # Tip: .body() must be fetched before .form().
-        # https://github.com/encode/starlette/discussions/1933
-        body_data = await request.body()
-        form_data = await request.form()
-        if len(form_data) > 0:
-            args.update({k: v.filename if isinstance(v, UploadFile) else v for k, v in form_data.items()})
-        else:
-            if body_data:
-                json_data = await request.json()
-                if not isinstance(json_data, dict):
-                    json_data = {
-                        f'{type(json_data)}_to_dict_data': json_data.decode('utf-8')
-                        if isinstance(json_data, bytes)
-                        else json_data
-                    }
-                args.update(json_data)
+        args.update(body_capture.args())
         return args
 
-    @staticmethod
-    @sync_to_async
-    def desensitization(args: dict) -> dict | None:
+    def desensitization(self, args: dict) -> dict | None:
         """
         desensitization
 
@@ -155,25 +411,22 @@ class OperaLogMiddleware(BaseHTTPMiddleware):
         :return:
         """
         if not args:
-            args = None
-        else:
-            match settings.OPERA_LOG_ENCRYPT_TYPE:
-                case OperaLogCipherType.aes:
-                    for key in args.keys():
-                        if key in settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE:
-                            args[key] = (AESCipher(settings.OPERA_LOG_ENCRYPT_SECRET_KEY).encrypt(args[key])).hex()
-                case OperaLogCipherType.md5:
-                    for key in args.keys():
-                        if key in settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE:
-                            args[key] = Md5Cipher.encrypt(args[key])
-                case OperaLogCipherType.itsdangerous:
-                    for key in args.keys():
-                        if key in settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE:
-                            args[key] = ItsDCipher(settings.OPERA_LOG_ENCRYPT_SECRET_KEY).encrypt(args[key])
-                case OperaLogCipherType.plan:
-                    pass
-                case _:
-                    for key in args.keys():
-                        if key in settings.OPERA_LOG_ENCRYPT_KEY_INCLUDE:
-                            args[key] = '******'
-        return args
+            return None
+        if self.encrypt is None:
+            return args
+        return desensitize(args, self.encrypt_keys, self.encrypt)
+
+    @staticmethod
+    def get_encrypt() -> Callable[[Any], Any] | None:
+        """Sensitive value encryption, built once; AES is left to the opera log writer"""
+        match settings.OPERA_LOG_ENCRYPT_TYPE:
+            case OperaLogCipherType.aes:
+                return None
+            case OperaLogCipherType.md5:
+                return Md5Cipher.encrypt
+            case OperaLogCipherType.itsdangerous:
+                return ItsDCipher(settings.OPERA_LOG_ENCRYPT_SECRET_KEY).encrypt
+            case OperaLogCipherType.plan:
+                return None
+            case _:
+                return lambda value: '******'
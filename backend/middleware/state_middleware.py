@@ -1,26 +1,22 @@
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware, RequestResponseEndpoint
+from starlette.requests import Request
+from starlette.types import ASGIApp, Receive, Scope, Send
 
-from backend.utils.request_parse import parse_ip_info, parse_user_agent_info
+from backend.utils.request_parse import RequestContext
 
 
-class StateMiddleware(BaseHTTPMiddleware):
+class StateMiddleware:
     """Request state middleware"""
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
-        ip_info = await parse_ip_info(request)
-        ua_info = parse_user_agent_info(request)
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
 
-        # Setting up additional request information
-        request.state.ip = ip_info.ip
-        request.state.country = ip_info.country
-        request.state.region = ip_info.region
-        request.state.city = ip_info.city
-        request.state.user_agent = ua_info.user_agent
-        request.state.os = ua_info.os
-        request.state.browser = ua_info.browser
-        request.state.device = ua_info.device
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
 
-        response = await call_next(request)
+        # Setting up additional request information, resolved lazily by whoever needs it
+        request = Request(scope)
+        request.state.context = RequestContext(request)
 
-        return response
+        await self.app(scope, receive, send)
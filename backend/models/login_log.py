@@ -1,6 +1,6 @@
 from datetime import datetime
 import sqlalchemy as sa
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import Mapped, declared_attr, mapped_column
 from sqlalchemy import func
 
 from backend.common.model import DataClassBase, get_id, id_key
@@ -10,6 +10,17 @@ class LoginLog(DataClassBase):
     """Login Log Table"""
 
     __tablename__ = 'login_log'
+    # Monthly range partitions, see backend.database.db_partition
+    __table_args__ = (
+        # Keyset pagination, see backend.common.pagination.cursor_paging_data
+        sa.Index('ix_login_log_login_time_id', 'login_time', 'id'),
+        {'postgresql_partition_by': 'RANGE (login_time)'},
+    )
+
+    @declared_attr.directive
+    def __mapper_args__(cls) -> dict:
+        # The table key also holds the partition key, rows are still identified by id alone
+        return {'primary_key': [cls.__table__.c.id]}
 
     id: Mapped[id_key] = mapped_column(init=False)
     user_x_id: Mapped[str] = mapped_column(sa.String(32))
@@ -24,5 +35,6 @@ class LoginLog(DataClassBase):
     browser: Mapped[str | None] = mapped_column(sa.String, comment='Browser')
     device: Mapped[str | None] = mapped_column(sa.String, comment='Device')
     msg: Mapped[str] = mapped_column(sa.TEXT, comment='Message')
-    login_time: Mapped[datetime] = mapped_column(comment='Login time')
+    # Part of the primary key, postgres requires the partition key in every unique constraint
+    login_time: Mapped[datetime] = mapped_column(primary_key=True, comment='Login time')
     created_time: Mapped[datetime] = mapped_column(sa.DateTime(timezone=True), init=False, default=func.now(), comment='Creation time')
@@ -1,5 +1,5 @@
 import sqlalchemy as sa
-from sqlalchemy.orm import Mapped, mapped_column
+from sqlalchemy.orm import Mapped, declared_attr, mapped_column
 from datetime import datetime
 from sqlalchemy.sql.functions import current_timestamp
 
@@ -11,6 +11,17 @@ class OperaLog(DataClassBase):
     """Operation Log Table"""
 
     __tablename__ = 'opera_log'
+    # Monthly range partitions, see backend.database.db_partition
+    __table_args__ = (
+        # Keyset pagination, see backend.common.pagination.cursor_paging_data
+        sa.Index('ix_opera_log_opera_time_id', 'opera_time', 'id'),
+        {'postgresql_partition_by': 'RANGE (opera_time)'},
+    )
+
+    @declared_attr.directive
+    def __mapper_args__(cls) -> dict:
+        # The table key also holds the partition key, rows are still identified by id alone
+        return {'primary_key': [cls.__table__.c.id]}
 
     id: Mapped[id_key] = mapped_column(init=False)
     # x_id: Mapped[str] = mapped_column(sa.String(32), unique=True, insert_default=get_id)
@@ -32,5 +43,6 @@ class OperaLog(DataClassBase):
     code: Mapped[str] = mapped_column(sa.String(20), insert_default='200', comment='Operation status code')
     msg: Mapped[str] = mapped_column(sa.TEXT, comment='Alert message')
     cost_time: Mapped[float] = mapped_column(insert_default=0.0, comment='Request elapsed time (ms)')
-    opera_time: Mapped[datetime] = mapped_column(comment="Operating time")
+    # Part of the primary key, postgres requires the partition key in every unique constraint
+    opera_time: Mapped[datetime] = mapped_column(primary_key=True, comment="Operating time")
     created_time: Mapped[datetime] = mapped_column(sa.DateTime(timezone=True), init=False, default=current_timestamp(), comment="Creation time")
\ No newline at end of file
@@ -13,6 +13,9 @@ from .associations import user_role
 
 
 class User(Base):
+    # Keyset pagination, see backend.common.pagination.cursor_paging_data
+    __table_args__ = (sa.Index('ix_user_join_time_id', 'join_time', 'id'),)
+
     id: Mapped[id_key] = mapped_column(init=False)
     x_id: Mapped[str] = mapped_column(sa.String(32), init=False, unique=True, default=get_id)
     firstname: Mapped[str] = mapped_column(sa.String, init=False, nullable=True)
@@ -1,5 +1,10 @@
+import asyncio
+
 from pathlib import Path
 
+from backend.common.security.hasher import calibrate
+from backend.core.conf import settings
+from backend.database.db_partition import log_partition_manager
 from backend.database.db_postgres import drop_all_tables, get_db
 import fire
 from sqlalchemyseed import load_entities_from_json
@@ -11,6 +16,15 @@ def drop_tables() -> None:
     drop_all_tables()
 
 
+def calibrate_password_hash(target_ms: int = settings.PASSWORD_HASH_TARGET_MS) -> None:
+    rounds = calibrate(target_ms)
+    print(f"bcrypt rounds for {target_ms} ms on this machine: {rounds} (set PASSWORD_HASH_ROUNDS={rounds})")
+
+
+def partition_log_tables() -> None:
+    asyncio.run(log_partition_manager.partition_tables())
+
+
 def seed() -> None:
     print("start: import_seed")
     db = next(get_db())
@@ -0,0 +1,88 @@
+import os
+
+# Settings are validated when backend.core.conf is first imported, the required ones get test values here.
+# Test dependencies are declared in the poetry dev group
+for _key, _value in {
+    'ENVIRONMENT': 'dev',
+    'OTLP_GRPC_ENDPOINT': 'http://localhost:4317',
+    'POSTGRES_HOST': 'localhost',
+    'POSTGRES_PORT': '5432',
+    'POSTGRES_USER': 'test',
+    'POSTGRES_PASSWORD': 'test',
+    'GENAI_API_KEY': 'test',
+    'REDIS_HOST': 'localhost',
+    'REDIS_PORT': '6379',
+    'REDIS_DATABASE': '0',
+    'MINIO_ENDPOINT': 'localhost',
+    'MINIO_PORT': '9000',
+    'MINIO_ACCESS_KEY': 'test',
+    'MINIO_SECRET_KEY': 'test',
+    'MINIO_BUCKET_NAME': 'test',
+    'MINIO_CLOUD_URL': 'http://localhost',
+    'SMTP_TLS': 'false',
+    'SMTP_PORT': '25',
+    'SMTP_HOST': 'localhost',
+    'SMTP_USER': 'test',
+    'SMTP_PASSWORD': 'test',
+    'EMAILS_FROM_EMAIL': 'test@example.com',
+    'EMAILS_FROM_NAME': 'test',
+    'TOKEN_SECRET_KEY': 'test',
+    'OPERA_LOG_ENCRYPT_SECRET_KEY': '00112233445566778899aabbccddeeff00112233445566778899aabbccddeeff',
+    'GOOGLE_CLIENT_ID': 'test',
+    'GOOGLE_SECRET_KEY': 'test',
+    'GOOGLE_WEBHOOK_OAUTH_REDIRECT_URI': 'http://localhost',
+}.items():
+    os.environ.setdefault(_key, _value)
+
+import fakeredis  # noqa: E402
+import pytest  # noqa: E402
+
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine  # noqa: E402
+from sqlalchemy.pool import StaticPool  # noqa: E402
+
+import backend.models  # noqa: E402, F401
+
+from backend.common.broadcast import broadcast  # noqa: E402
+from backend.common.model import MappedBase  # noqa: E402
+from backend.database.db_redis import RedisCli, redis_client  # noqa: E402
+
+
+@pytest.fixture
+async def redis(monkeypatch) -> RedisCli:
+    """The shared redis client, backed by an in-memory server"""
+    fake = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(redis_client, 'connection_pool', fake.connection_pool)
+    yield redis_client
+    await fake.aclose()
+
+
+@pytest.fixture
+async def db_engine() -> AsyncEngine:
+    """In-memory database with every table but the (Postgres partitioned) log tables"""
+    engine = create_async_engine('sqlite+aiosqlite://', poolclass=StaticPool)
+    tables = [table for name, table in MappedBase.metadata.tables.items() if not name.endswith('_log')]
+    async with engine.begin() as conn:
+        await conn.run_sync(MappedBase.metadata.create_all, tables=tables)
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def db_session(db_engine: AsyncEngine) -> async_sessionmaker:
+    return async_sessionmaker(bind=db_engine, autoflush=False, expire_on_commit=False)
+
+
+@pytest.fixture
+def published(monkeypatch) -> list[tuple[str, str | int]]:
+    """Messages broadcast to the other workers, nothing is listened to"""
+    published = []
+
+    async def publish(channel: str, message: str | int) -> None:
+        published.append((channel, message))
+
+    async def start() -> None:
+        pass
+
+    monkeypatch.setattr(broadcast, 'publish', publish)
+    monkeypatch.setattr(broadcast, 'start', start)
+    return published
@@ -0,0 +1,75 @@
+from datetime import date
+
+import pytest
+
+from backend.core.conf import settings
+from backend.database.db_partition import LogPartitionManager, _add_months
+
+
+class _Result:
+    def __init__(self, rows: list[tuple]):
+        self.rows = rows
+
+    def all(self) -> list[tuple]:
+        return self.rows
+
+
+class _Conn:
+    """Answers the partition listing and records the DDL"""
+
+    def __init__(self, partitions: list[str]):
+        self.partitions = partitions
+        self.statements: list[str] = []
+
+    async def execute(self, statement, params: dict | None = None) -> _Result:
+        sql = str(statement)
+        if sql.startswith('SELECT'):
+            return _Result([(name,) for name in self.partitions])
+        self.statements.append(sql)
+        return _Result([])
+
+
+@pytest.mark.parametrize(
+    ('month', 'months', 'expected'),
+    [
+        (date(2026, 10, 1), 0, date(2026, 10, 1)),
+        (date(2026, 10, 1), 1, date(2026, 11, 1)),
+        (date(2026, 10, 1), 3, date(2027, 1, 1)),
+        (date(2026, 12, 1), 1, date(2027, 1, 1)),
+        (date(2026, 1, 1), -1, date(2025, 12, 1)),
+        (date(2026, 10, 1), -22, date(2024, 12, 1)),
+        (date(2026, 10, 1), 24, date(2028, 10, 1)),
+    ],
+)
+def test_add_months(month: date, months: int, expected: date):
+    assert _add_months(month, months) == expected
+
+
+def test_partition_name():
+    assert LogPartitionManager.partition_name('opera_log', date(2026, 3, 1)) == 'opera_log_p202603'
+    assert LogPartitionManager.partition_name('login_log', date(2027, 12, 1)) == 'login_log_p202712'
+
+
+@pytest.mark.parametrize('detach_only', [False, True])
+async def test_retention_drops_only_the_months_past_the_cutoff(monkeypatch, detach_only: bool):
+    monkeypatch.setattr(settings, 'LOG_PARTITION_DETACH_ONLY', detach_only)
+    conn = _Conn([
+        'opera_log_p202606',
+        'opera_log_p202607',
+        'opera_log_p202609',
+        'opera_log_p202610',
+        'opera_log_p202512',
+        'opera_log_default',
+        'opera_log_p202606_old',
+    ])
+    # Three months kept in October 2026: July, August and September, plus the current month
+    cutoff = _add_months(date(2026, 10, 1), -3)
+    await LogPartitionManager({})._drop_partitions(conn, 'opera_log', cutoff)
+
+    dropped = ['opera_log_p202606', 'opera_log_p202512']
+    expected = []
+    for name in dropped:
+        expected.append(f'ALTER TABLE opera_log DETACH PARTITION {name}')
+        if not detach_only:
+            expected.append(f'DROP TABLE {name}')
+    assert conn.statements == expected
@@ -0,0 +1,42 @@
+import pytest
+
+from backend.common.security import hasher as hasher_module
+from backend.common.security.hasher import PasswordHasher, pwd_context
+from backend.core.conf import settings
+
+
+@pytest.fixture(autouse=True)
+def restore_context():
+    saved = pwd_context.to_dict()
+    yield
+    pwd_context.load(saved)
+
+
+async def test_calibrated_once_per_deployment(redis, monkeypatch):
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_ROUNDS', None)
+    monkeypatch.setattr(settings, 'PASSWORD_HASH_CALIBRATE', True)
+    calibrations = []
+
+    def calibrate(target_ms: int) -> int:
+        calibrations.append(target_ms)
+        return 5
+
+    monkeypatch.setattr(hasher_module, 'calibrate', calibrate)
+    workers = [PasswordHasher(), PasswordHasher()]
+    for worker in workers:
+        await worker.setup()
+    assert calibrations == [settings.PASSWORD_HASH_TARGET_MS]
+    assert [worker.rounds for worker in workers] == [5, 5]
+    assert await redis.get(settings.PASSWORD_HASH_ROUNDS_REDIS_KEY) == '5'
+
+
+async def test_rounds_are_a_floor():
+    hasher = PasswordHasher()
+    hasher.set_rounds(5)
+    stronger = pwd_context.handler('bcrypt').using(rounds=6).hash('password')
+    weaker = pwd_context.handler('bcrypt').using(rounds=4).hash('password')
+    assert await hasher.verify_and_update('password', stronger) == (True, None)
+    valid, new_hash = await hasher.verify_and_update('password', weaker)
+    assert valid
+    assert pwd_context.handler('bcrypt').from_string(new_hash).rounds == 5
+    hasher.shutdown()
@@ -0,0 +1,144 @@
+import itertools
+
+from datetime import timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.responses import Response
+
+from backend.app.admin.service import user_service as user_service_module
+from backend.app.admin.service.auth_service import auth_service
+from backend.app.admin.service.user_service import user_service
+from backend.common.broadcast import broadcast
+from backend.common.exception.errors import TokenError
+from backend.common.security import jwt
+from backend.common.security.hasher import pwd_context
+from backend.core.conf import settings
+from backend.database.db_redis import RedisCli
+from backend.models import User
+from backend.schemas.user import UpdatePasswordParam
+from backend.utils.timezone import timezone
+
+
+@pytest.fixture(autouse=True)
+def token_cache(monkeypatch):
+    # Tokens are issued a second apart, so that every session gets its own token
+    now = timezone.now()
+    seconds = itertools.count()
+    monkeypatch.setattr(timezone, 'now', lambda: now + timedelta(seconds=next(seconds)))
+    yield jwt.token_cache
+    jwt.token_cache.clear()
+    jwt.user_cache.clear()
+
+
+async def login(sub: str, multi_login: bool = True) -> tuple[str, str]:
+    access = await jwt.create_access_token(sub, multi_login)
+    refresh = await jwt.create_refresh_token(sub, multi_login)
+    return access.access_token, refresh.refresh_token
+
+
+async def assert_revoked(redis: RedisCli, sub: str, *tokens: str) -> None:
+    jwt.token_cache.clear()
+    for token in tokens:
+        with pytest.raises(TokenError):
+            await jwt.jwt_authentication(token)
+    # Only the generation is left
+    assert await redis.keys('*') == [f'{settings.TOKEN_GENERATION_REDIS_PREFIX}:{sub}']
+
+
+async def test_token_of_an_older_generation_is_refused(redis: RedisCli, published: list):
+    access, _ = await login('u')
+    assert await jwt.jwt_authentication(access) == 'u'
+    jwt.token_cache.clear()
+
+    await redis.incr(f'{settings.TOKEN_GENERATION_REDIS_PREFIX}:u')
+    # The token key itself is still there
+    assert await redis.exists(f'{settings.TOKEN_REDIS_PREFIX}:u:{access}')
+    with pytest.raises(TokenError):
+        await jwt.jwt_authentication(access)
+    with pytest.raises(TokenError):
+        await jwt.jwt_authentication_with_user(access)
+    # Tokens issued afterwards carry the new generation
+    access, _ = await login('u')
+    assert await jwt.jwt_authentication(access) == 'u'
+
+
+async def test_logout_revokes_every_session(redis: RedisCli, published: list):
+    sessions = [await login('u'), await login('u')]
+    request = SimpleNamespace(
+        headers={'Authorization': f'Bearer {sessions[0][0]}'}, cookies={}, user=SimpleNamespace(x_id='u')
+    )
+    await auth_service.logout(request=request, response=Response())
+    await assert_revoked(redis, 'u', *(token for session in sessions for token in session))
+    assert published == [(settings.TOKEN_REVOKE_CHANNEL, 'u')]
+
+
+async def test_password_update_revokes_every_session(
+    monkeypatch, redis: RedisCli, published: list, db_session: async_sessionmaker
+):
+    monkeypatch.setattr(user_service_module, 'async_db_session', db_session)
+    async with db_session.begin() as db:
+        user = User(email='u@example.com', password=pwd_context.hash('oldNone', rounds=4), salt=None)
+        db.add(user)
+    sessions = [await login(user.x_id), await login(user.x_id)]
+
+    request = SimpleNamespace(user=SimpleNamespace(id=user.id, x_id=user.x_id))
+    obj = UpdatePasswordParam(old_password='old', new_password='new', confirm_password='new')
+    assert await user_service.pwd_update(request=request, obj=obj) == 1
+    await assert_revoked(redis, user.x_id, *(token for session in sessions for token in session))
+
+
+async def test_single_login_only_drops_the_keys_of_its_kind(redis: RedisCli, published: list):
+    other_sub_access, _ = await login('other')
+    access, refresh = await login('u')
+
+    new_access = (await jwt.create_access_token('u', multi_login=False)).access_token
+    assert not await redis.exists(f'{settings.TOKEN_REDIS_PREFIX}:u:{access}')
+    assert await redis.get(f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:u:{refresh}') == refresh
+
+    new_refresh = (await jwt.create_refresh_token('u', multi_login=False)).refresh_token
+    assert not await redis.exists(f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:u:{refresh}')
+    assert await redis.get(f'{settings.TOKEN_REDIS_PREFIX}:u:{new_access}') == new_access
+    assert set(await redis.zrange(f'{settings.TOKEN_INDEX_REDIS_PREFIX}:u', 0, -1)) == {
+        f'{settings.TOKEN_REDIS_PREFIX}:u:{new_access}',
+        f'{settings.TOKEN_REFRESH_REDIS_PREFIX}:u:{new_refresh}',
+    }
+    # Another user's sessions are left alone
+    assert await jwt.jwt_authentication(other_sub_access) == 'other'
+
+
+async def test_cached_token_expires_at_its_exp(redis: RedisCli, published: list, monkeypatch):
+    access, _ = await login('u')
+    assert await jwt.jwt_authentication(access) == 'u'
+    await redis.flushall()
+    # Served from the local cache, without redis
+    assert await jwt.jwt_authentication(access) == 'u'
+
+    exp = jwt.jwt_payload(access)['exp']
+    monkeypatch.setattr(jwt.time, 'time', lambda: exp)
+    with pytest.raises(TokenError):
+        jwt.cached_jwt_authentication(access)
+    assert len(jwt.token_cache) == 0
+
+
+@pytest.mark.parametrize('broadcast_received', [False, True])
+async def test_revoked_token_cache_drops_the_user_tokens(
+    redis: RedisCli, published: list, broadcast_received: bool
+):
+    tokens = [(await login('u'))[0], (await login('u'))[0]]
+    other_access, _ = await login('other')
+    for token in [*tokens, other_access]:
+        await jwt.jwt_authentication(token)
+
+    if broadcast_received:
+        # Another worker revoked them
+        for handler in broadcast._handlers[settings.TOKEN_REVOKE_CHANNEL]:
+            await handler('u')
+    else:
+        await jwt.revoke_token_cache('u')
+        assert published == [(settings.TOKEN_REVOKE_CHANNEL, 'u')]
+    for token in tokens:
+        assert jwt.cached_jwt_authentication(token) is None
+    assert jwt.cached_jwt_authentication(other_access) == 'other'
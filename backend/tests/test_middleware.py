@@ -0,0 +1,170 @@
+import asyncio
+import time
+
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from fastapi import FastAPI, Request
+from prometheus_client import REGISTRY
+from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.responses import StreamingResponse
+from starlette.types import Message
+
+from backend.middleware import access_middleware
+from backend.middleware.access_middleware import AccessMiddleware
+from backend.middleware.i18n_middleware import I18nMiddleware
+from backend.middleware.state_middleware import StateMiddleware
+from backend.utils.prometheus import PrometheusMiddleware
+
+APP_NAME = 'test-middleware'
+# Outermost first
+STACK = [PrometheusMiddleware, I18nMiddleware, AccessMiddleware, StateMiddleware]
+
+
+def create_app(*middleware: type) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/items/{pk}', status_code=201)
+    async def item(request: Request, pk: int) -> dict:
+        return {'pk': pk, 'locale': request.state.locale, 'ip': request.state.context.ip}
+
+    @app.get('/boom')
+    async def boom() -> None:
+        raise RuntimeError('boom')
+
+    @app.get('/ping')
+    async def ping() -> dict:
+        return {}
+
+    app.state.sent = []
+    app.state.delivered = []
+
+    @app.get('/stream')
+    async def stream(request: Request) -> StreamingResponse:
+        async def chunks():
+            for chunk in (b'a', b'b', b'c'):
+                yield chunk
+                # How many chunks the server had received when the next one is asked for
+                request.app.state.delivered.append(len(request.app.state.sent))
+
+        return StreamingResponse(chunks())
+
+    for cls in reversed(middleware):
+        if cls is PrometheusMiddleware:
+            app.add_middleware(cls, app_name=APP_NAME)
+        else:
+            app.add_middleware(cls)
+    return app
+
+
+def client(app: FastAPI) -> httpx.AsyncClient:
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False, client=('10.0.0.1', 1234))
+    return httpx.AsyncClient(transport=transport, base_url='http://test')
+
+
+@pytest.fixture
+def access_log(monkeypatch) -> list[str]:
+    lines = []
+    monkeypatch.setattr(access_middleware, 'log', SimpleNamespace(info=lines.append))
+    return lines
+
+
+def responses(path: str, status_code: int) -> float:
+    labels = {'method': 'GET', 'path': path, 'status_code': str(status_code), 'app_name': APP_NAME}
+    return REGISTRY.get_sample_value('fastapi_responses_total', labels) or 0
+
+
+async def test_prometheus_records_the_status_code(access_log: list[str]):
+    created, failed = responses('/items/{pk}', 201), responses('/boom', 500)
+    exceptions = {'method': 'GET', 'path': '/boom', 'exception_type': 'RuntimeError', 'app_name': APP_NAME}
+    raised = REGISTRY.get_sample_value('fastapi_exceptions_total', exceptions) or 0
+
+    async with client(create_app(*STACK)) as c:
+        assert (await c.get('/items/1')).status_code == 201
+        assert (await c.get('/boom')).status_code == 500
+    assert responses('/items/{pk}', 201) == created + 1
+    assert responses('/boom', 500) == failed + 1
+    assert REGISTRY.get_sample_value('fastapi_exceptions_total', exceptions) == raised + 1
+
+
+async def test_access_log_records_the_status_code(access_log: list[str]):
+    async with client(create_app(*STACK)) as c:
+        await c.get('/items/1')
+        await c.get('/missing')
+    assert [line.split(' | ')[:4] for line in access_log] == [
+        ['10.0.0.1       ', 'GET     ', '201   ', '/items/1'],
+        ['10.0.0.1       ', 'GET     ', '404   ', '/missing'],
+    ]
+
+
+async def test_request_state_reaches_the_handler(access_log: list[str]):
+    async with client(create_app(*STACK)) as c:
+        response = await c.get('/items/1', headers={'locale': 'en', 'X-Real-IP': '10.0.0.2'})
+        assert response.json() == {'pk': 1, 'locale': 'en', 'ip': '10.0.0.2'}
+        response = await c.get('/items/1', params={'locale': 'de'})
+        assert response.json() == {'pk': 1, 'locale': 'fr', 'ip': '10.0.0.1'}
+
+
+async def test_streaming_response_is_not_buffered(access_log: list[str]):
+    app = create_app(*STACK)
+    # httpx reads the whole body before returning, the server side is driven by hand
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0', 'spec_version': '2.4'},
+        'http_version': '1.1',
+        'method': 'GET',
+        'scheme': 'http',
+        'path': '/stream',
+        'raw_path': b'/stream',
+        'root_path': '',
+        'query_string': b'',
+        'headers': [],
+        'client': ('10.0.0.1', 1234),
+        'server': ('test', 80),
+    }
+    requested = False
+
+    async def receive() -> Message:
+        nonlocal requested
+        if requested:
+            # The client stays connected, the response stops listening once it is sent
+            await asyncio.Event().wait()
+        requested = True
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message: Message) -> None:
+        if message['type'] == 'http.response.body' and message['body']:
+            app.state.sent.append(message['body'])
+
+    await app(scope, receive, send)
+    assert app.state.sent == [b'a', b'b', b'c']
+    # Every chunk was sent on before the next one was produced
+    assert app.state.delivered == [1, 2, 3]
+
+
+class _Passthrough(BaseHTTPMiddleware):
+    async def dispatch(self, request, call_next):
+        return await call_next(request)
+
+
+@pytest.mark.bench
+async def test_per_layer_overhead(access_log: list[str]):
+    async def request_us(app: FastAPI, number: int = 2000) -> float:
+        async with client(app) as c:
+            for _ in range(100):
+                await c.get('/ping')
+            start = time.perf_counter()
+            for _ in range(number):
+                await c.get('/ping')
+            return (time.perf_counter() - start) / number * 1e6
+
+    bare = await request_us(create_app())
+    # A BaseHTTPMiddleware doing nothing, the least each layer used to cost
+    before = (await request_us(create_app(*[_Passthrough] * len(STACK))) - bare) / len(STACK)
+    after = (await request_us(create_app(*STACK)) - bare) / len(STACK)
+    print(f'\nrequest without middleware: {bare:8.1f} us')
+    print(f'per layer, BaseHTTPMiddleware: {before:6.1f} us')
+    print(f'per layer, pure ASGI:          {after:6.1f} us')
+    assert after < before
@@ -0,0 +1,112 @@
+import json
+
+import pytest
+
+from starlette.types import Message
+
+from backend.middleware.opera_log_middleware import BodyCapture, OperaLogRule, OperaLogRules
+
+REDACT_KEYS = frozenset({'password'})
+
+
+async def capture(body: bytes, content_type: str | None, max_bytes: int = 1024, chunk_size: int = 7) -> dict:
+    chunks = [body[i : i + chunk_size] for i in range(0, len(body), chunk_size)] or [b'']
+    messages = [
+        {'type': 'http.request', 'body': chunk, 'more_body': i < len(chunks) - 1} for i, chunk in enumerate(chunks)
+    ]
+
+    async def receive() -> Message:
+        return messages.pop(0)
+
+    body_capture = BodyCapture(receive, content_type, max_bytes, REDACT_KEYS)
+    received = b''
+    for _ in range(len(chunks)):
+        # The application still receives the whole body
+        received += (await body_capture())['body']
+    assert received == body
+    return body_capture.args()
+
+
+def multipart(boundary: str, parts: list[tuple[str, str | None, bytes]]) -> bytes:
+    body = b''
+    for name, filename, data in parts:
+        disposition = f'form-data; name="{name}"' + (f'; filename="{filename}"' if filename else '')
+        body += f'--{boundary}\r\nContent-Disposition: {disposition}\r\n\r\n'.encode() + data + b'\r\n'
+    return body + f'--{boundary}--\r\n'.encode()
+
+
+async def test_json_body():
+    assert await capture(json.dumps({'name': 'a', 'n': 1}).encode(), 'application/json') == {'name': 'a', 'n': 1}
+
+
+async def test_urlencoded_body():
+    assert await capture(b'name=a&empty=', 'application/x-www-form-urlencoded') == {'name': 'a', 'empty': ''}
+
+
+async def test_binary_body_is_not_kept():
+    assert await capture(b'\x00' * 100, 'application/octet-stream') == {'__body_skipped__': 'application/octet-stream'}
+
+
+async def test_multipart_keeps_fields_and_file_names():
+    body = multipart('xyz', [('title', None, b'hello'), ('file', 'a.png', b'\x89PNG' * 100)])
+    assert await capture(body, 'multipart/form-data; boundary=xyz') == {'title': 'hello', 'file': 'a.png'}
+
+
+async def test_multipart_fields_are_bounded():
+    body = multipart('xyz', [('title', None, b'x' * 100), ('note', None, b'y' * 100)])
+    args = await capture(body, 'multipart/form-data; boundary=xyz', max_bytes=120)
+    assert args == {'title': 'x' * 100, 'note': 'y' * 20, '__body_truncated__': len(body)}
+
+
+@pytest.mark.parametrize(
+    'body, content_type',
+    [
+        (b'{"name": "a", "password": "secret", "bio": "' + b'z' * 200 + b'"}', 'application/json'),
+        (b'name=a&password=secret&bio=' + b'z' * 200, 'application/x-www-form-urlencoded'),
+    ],
+)
+async def test_truncated_body_keeps_a_redacted_prefix(body: bytes, content_type: str):
+    args = await capture(body, content_type, max_bytes=64)
+    assert args['__body_truncated__'] == len(body)
+    assert 'name' in args['__body_prefix__']
+    assert 'secret' not in args['__body_prefix__']
+    assert '******' in args['__body_prefix__']
+
+
+@pytest.mark.parametrize(
+    'method, status_code, logged',
+    [
+        ('GET', 200, False),
+        ('HEAD', 304, False),
+        ('GET', 404, True),
+        ('GET', 500, True),
+        # The application raised
+        ('GET', None, True),
+        ('POST', 200, True),
+        ('DELETE', 204, True),
+    ],
+)
+@pytest.mark.parametrize('rule', [OperaLogRule(sample_rate=0), OperaLogRule(never=True)])
+def test_failed_and_writing_requests_are_always_logged(
+    rule: OperaLogRule, method: str, status_code: int | None, logged: bool
+):
+    assert rule.should_log(method, status_code, 1.0) is logged
+
+
+def test_slow_reads_are_logged():
+    rule = OperaLogRule(sample_rate=0, slow_ms=100)
+    assert rule.should_log('GET', 200, 150)
+    assert not rule.should_log('GET', 200, 50)
+
+
+def test_rules_match_method_first():
+    rules = OperaLogRules(
+        [
+            {'method': '*', 'path': '/api/v1/logs', 'never': True},
+            {'method': 'GET', 'path': '/api/v1/logs', 'sample_rate': 0.5},
+        ]
+    )
+    assert rules.match('GET', '/api/v1/logs').sample_rate == 0.5
+    assert rules.match('HEAD', '/api/v1/logs').never
+    assert rules.match('GET', '/api/v1/users') is rules.default
+    assert rules.match('GET', None) is rules.default
@@ -0,0 +1,89 @@
+import asyncio
+
+from datetime import datetime
+
+import pytest
+
+from backend.app.admin.schema.opera_log import CreateOperaLogParam
+from backend.app.admin.service import opera_log_service as opera_log_service_module
+from backend.app.admin.service.opera_log_service import OperaLogWriter
+from backend.core.conf import settings
+
+
+def opera_log(trace_id: str, args: dict | None = None) -> CreateOperaLogParam:
+    return CreateOperaLogParam(
+        trace_id=trace_id,
+        method='POST',
+        title='',
+        path='/api/v1/users',
+        ip='127.0.0.1',
+        user_agent='',
+        args=args,
+        code='200',
+        cost_time=1.0,
+        opera_time=datetime.now(),
+    )
+
+
+class _Dao:
+    def __init__(self):
+        self.batches: list[list[str]] = []
+        self.writable = asyncio.Event()
+        self.writable.set()
+
+    async def bulk_create(self, db, objs_in: list[CreateOperaLogParam]) -> None:
+        self.batches.append([obj_in.trace_id for obj_in in objs_in])
+        await self.writable.wait()
+
+
+class _Cipher:
+    @staticmethod
+    def encrypt(value: str) -> bytes:
+        if value == 'unencryptable':
+            raise ValueError(value)
+        return value.encode()
+
+
+@pytest.fixture
+def dao(monkeypatch, db_session) -> _Dao:
+    dao = _Dao()
+    monkeypatch.setattr(opera_log_service_module, 'opera_log_dao', dao)
+    monkeypatch.setattr(opera_log_service_module, 'async_db_session', db_session)
+    monkeypatch.setattr(settings, 'OPERA_LOG_FLUSH_INTERVAL_SECONDS', 0.05)
+    return dao
+
+
+async def test_records_are_written_in_batches(dao: _Dao, monkeypatch):
+    monkeypatch.setattr(settings, 'OPERA_LOG_BATCH_SIZE', 2)
+    writer = OperaLogWriter()
+    # Started on first use when the lifespan did not start it
+    for i in range(5):
+        await writer.put(opera_log(str(i)))
+    await writer.stop()
+    assert dao.batches == [['0', '1'], ['2', '3'], ['4']]
+
+
+async def test_full_queue_drops_instead_of_blocking(dao: _Dao, monkeypatch):
+    monkeypatch.setattr(settings, 'OPERA_LOG_QUEUE_MAXSIZE', 1)
+    monkeypatch.setattr(settings, 'OPERA_LOG_QUEUE_PUT_TIMEOUT_SECONDS', 0.01)
+    monkeypatch.setattr(settings, 'OPERA_LOG_BATCH_SIZE', 1)
+    dao.writable.clear()
+    writer = OperaLogWriter()
+    await writer.put(opera_log('0'))
+    while not dao.batches:
+        await asyncio.sleep(0)
+    # The writer is stuck on the database, one record fits in the queue, the next one is dropped
+    await writer.put(opera_log('1'))
+    await asyncio.wait_for(writer.put(opera_log('2')), 1)
+    dao.writable.set()
+    await writer.stop()
+    assert dao.batches == [['0'], ['1']]
+
+
+async def test_encryption_failure_drops_the_record_only(dao: _Dao):
+    writer = OperaLogWriter()
+    writer._aes, writer._encrypt_keys = _Cipher(), frozenset({'password'})
+    for trace_id, password in (('0', 'secret'), ('1', 'unencryptable'), ('2', 'secret')):
+        await writer.put(opera_log(trace_id, {'password': password}))
+    await writer.stop()
+    assert dao.batches == [['0', '2']]
@@ -0,0 +1,123 @@
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+import pytest
+
+from fastapi import FastAPI, Request
+from httpx import ASGITransport, AsyncClient
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.common.exception import errors
+from backend.common.enums import CountStrategy
+from backend.common.pagination import (
+    CursorParams,
+    DependsPagination,
+    _decode_cursor,
+    _encode_cursor,
+    cursor_paging_data,
+    paging_data,
+)
+from backend.models import Role, User
+
+
+class _User(BaseModel):
+    model_config = ConfigDict(from_attributes=True)
+
+    id: int
+    email: str
+
+
+@pytest.fixture
+async def client(db_session: async_sessionmaker) -> AsyncClient:
+    app = FastAPI()
+
+    @app.get('/users/cursor')
+    async def users_cursor(request: Request, params: CursorParams) -> dict:
+        async with db_session() as db:
+            return await cursor_paging_data(
+                db, select(User), _User, request=request, params=params, order_column=User.join_time, id_column=User.id
+            )
+
+    @app.get('/users', dependencies=[DependsPagination])
+    async def users(count_strategy: CountStrategy = CountStrategy.exact) -> dict:
+        async with db_session() as db:
+            return await paging_data(db, select(User).order_by(User.id), _User, count_strategy)
+
+    async with AsyncClient(transport=ASGITransport(app=app), base_url='http://test') as client:
+        yield client
+
+
+@pytest.fixture
+async def user_ids(db_session: async_sessionmaker) -> list[int]:
+    """25 users, newest first, joined in groups of 3 sharing a join time, each with the (eager loaded) roles"""
+    start = datetime(2026, 1, 1)
+    async with db_session.begin() as db:
+        roles = [Role(name='editor', remark=''), Role(name='viewer', remark='')]
+        users = []
+        for i in range(25):
+            user = User(email=f'{i}@example.com', password='x', salt=None)
+            user.join_time = start + timedelta(days=i // 3)
+            user.roles.extend(roles)
+            users.append(user)
+        db.add_all(users)
+    return [user.id for user in sorted(users, key=lambda user: (user.join_time, user.id), reverse=True)]
+
+
+def test_cursor_round_trip():
+    key = (datetime(2026, 1, 2, 3, 4, 5, 6), 42)
+    assert _decode_cursor(_encode_cursor('next', key)) == ('next', key)
+    assert _decode_cursor(_encode_cursor('prev', key)) == ('prev', key)
+
+
+@pytest.mark.parametrize('cursor', ['garbage', _encode_cursor('sideways', (datetime(2026, 1, 1), 1))])
+def test_invalid_cursor(cursor: str):
+    with pytest.raises(errors.RequestError):
+        _decode_cursor(cursor)
+
+
+async def test_keyset_pages_forth_and_back(client: AsyncClient, user_ids: list[int]):
+    async def get(link: str) -> dict:
+        response = await client.get(link)
+        assert response.status_code == 200
+        return response.json()
+
+    pages = [await get('/users/cursor?size=10')]
+    while pages[-1]['links']['next']:
+        pages.append(await get(pages[-1]['links']['next']))
+    assert [[user['id'] for user in page['items']] for page in pages] == [
+        user_ids[:10],
+        user_ids[10:20],
+        user_ids[20:],
+    ]
+    assert pages[0]['links']['prev'] is None
+
+    previous = await get(pages[-1]['links']['prev'])
+    assert previous['items'] == pages[1]['items']
+    assert parse_qs(urlsplit(previous['links']['next']).query)['cursor']
+    first = await get(previous['links']['prev'])
+    assert first['items'] == pages[0]['items']
+    assert first['links']['prev'] is None
+
+
+async def test_exact_count(client: AsyncClient, user_ids: list[int]):
+    page = (await client.get('/users', params={'size': 10, 'page': 3})).json()
+    assert page['total'] == 25
+    assert page['count_strategy'] == 'exact'
+    assert [user['id'] for user in page['items']] == sorted(user_ids)[20:]
+
+
+async def test_failed_estimate_reports_exact(client: AsyncClient, user_ids: list[int]):
+    # No planner statistics to read outside Postgres
+    page = (await client.get('/users', params={'size': 10, 'count_strategy': 'estimated'})).json()
+    assert page['total'] == 25
+    assert page['count_strategy'] == 'exact'
+
+
+async def test_cached_count_reports_exact_on_a_miss(client: AsyncClient, user_ids: list[int], redis):
+    params = {'size': 10, 'count_strategy': 'cached'}
+    page = (await client.get('/users', params=params)).json()
+    assert (page['total'], page['count_strategy']) == (25, 'exact')
+    page = (await client.get('/users', params=params)).json()
+    assert (page['total'], page['count_strategy']) == (25, 'cached')
@@ -0,0 +1,121 @@
+from types import SimpleNamespace
+
+import pytest
+
+from prometheus_client import REGISTRY
+from sqlalchemy import delete
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker
+
+from backend.common.security import rbac as rbac_module
+from backend.common.security.rbac import RBAC
+from backend.core.conf import settings
+from backend.models import CasbinRule, Role
+
+
+@pytest.fixture
+async def role_x_id(db_session: async_sessionmaker) -> str:
+    async with db_session.begin() as db:
+        role = Role(name='editor', remark='')
+        db.add(role)
+        await db.flush()
+        db.add(CasbinRule(ptype='p', v0=role.x_id, v1='/api/v1/users/{pk}', v2='GET'))
+    return role.x_id
+
+
+@pytest.fixture
+def rbac(monkeypatch, redis, published, db_engine: AsyncEngine, db_session: async_sessionmaker) -> RBAC:
+    monkeypatch.setattr(rbac_module, 'async_engine', db_engine)
+    monkeypatch.setattr(rbac_module, 'async_db_session', db_session)
+    return RBAC()
+
+
+async def test_policy_changed_reloads_the_writing_worker(
+    rbac: RBAC, role_x_id: str, published: list, db_session: async_sessionmaker
+):
+    await rbac.enforcer()
+    assert rbac._index.enforce(role_x_id, '/api/v1/users/1', 'GET')
+    rbac.decision_cache.set((rbac.policy_version, (role_x_id,), 'GET', '/api/v1/users/{pk}'), True)
+
+    async with db_session.begin() as db:
+        await db.execute(delete(CasbinRule))
+        db.add(CasbinRule(ptype='p', v0=role_x_id, v1='/api/v1/roles/{pk}', v2='GET'))
+    await rbac.policy_changed()
+
+    # Reloaded locally, without waiting for its own broadcast
+    assert rbac.policy_version == 1
+    assert len(rbac.decision_cache) == 0
+    assert not rbac._index.enforce(role_x_id, '/api/v1/users/1', 'GET')
+    assert rbac._index.enforce(role_x_id, '/api/v1/roles/1', 'GET')
+    assert published == [(settings.RBAC_CASBIN_POLICY_CHANNEL, 1)]
+
+
+async def test_broadcast_reloads_only_newer_versions(rbac: RBAC, role_x_id: str, monkeypatch):
+    await rbac.enforcer()
+    await rbac.policy_changed()
+    reloads = []
+    load_policy = rbac.load_policy
+
+    async def counting_load_policy() -> None:
+        reloads.append(1)
+        await load_policy()
+
+    monkeypatch.setattr(rbac, 'load_policy', counting_load_policy)
+    # Its own broadcast
+    await rbac._on_policy_changed('1')
+    assert reloads == []
+    # Another worker wrote
+    await rbac_module.redis_client.incr(settings.RBAC_CASBIN_POLICY_VERSION_KEY)
+    await rbac._on_policy_changed('2')
+    assert reloads == [1]
+    assert rbac.policy_version == 2
+
+
+async def test_load_subjects_swaps_in_a_bounded_enforcer(
+    rbac: RBAC, role_x_id: str, db_session: async_sessionmaker, monkeypatch
+):
+    monkeypatch.setattr(settings, 'RBAC_LOADED_SUBJECTS_MAXSIZE', 2)
+    async with db_session.begin() as db:
+        for sub in ('u1', 'u2', 'u3'):
+            db.add(CasbinRule(ptype='p', v0=sub, v1=f'/api/v1/{sub}', v2='GET'))
+    shared = await rbac.enforcer()
+
+    enforcer = await rbac.load_subjects('u1', 'u2')
+    # The enforcer in use is never cleared for a reload, a new one replaces it
+    assert enforcer is not shared
+    assert not shared.has_policy('u1', '/api/v1/u1', 'GET')
+    assert enforcer.has_policy('u1', '/api/v1/u1', 'GET')
+    assert enforcer.has_policy(role_x_id, '/api/v1/users/{pk}', 'GET')
+
+    enforcer = await rbac.load_subjects('u3')
+    assert enforcer.has_policy('u3', '/api/v1/u3', 'GET')
+    assert not enforcer.has_policy('u1', '/api/v1/u1', 'GET')
+    assert enforcer.has_policy(role_x_id, '/api/v1/users/{pk}', 'GET')
+    assert await rbac.load_subjects('u3') is enforcer
+
+
+def _request(role_x_id: str) -> SimpleNamespace:
+    role = SimpleNamespace(x_id=role_x_id, data_scope=0)
+    user = SimpleNamespace(x_id='user', is_superuser=False, is_staff=True, roles=[role])
+    return SimpleNamespace(auth=SimpleNamespace(scopes=['authenticated']), user=user)
+
+
+async def test_check_keeps_client_paths_out_of_the_decision_cache(rbac: RBAC, role_x_id: str):
+    request = _request(role_x_id)
+    assert await rbac.check(request, 'GET', '/api/v1/users/1')
+    assert not await rbac.check(request, 'GET', '/api/v1/roles/1')
+    assert len(rbac.decision_cache) == 0
+
+    await rbac.verify(request, 'GET', '/api/v1/users/1', '/api/v1/users/{pk}')
+    assert rbac.decision_cache.get((rbac.policy_version, (role_x_id,), 'GET', '/api/v1/users/{pk}')) is True
+
+
+async def test_decision_cache_lookups_are_exported(rbac: RBAC, role_x_id: str):
+    def lookups() -> tuple[float, ...]:
+        samples = (REGISTRY.get_sample_value('rbac_decision_cache_total', {'result': r}) for r in ('hit', 'miss'))
+        return tuple(sample or 0 for sample in samples)
+
+    request = _request(role_x_id)
+    hits, misses = lookups()
+    for pk in (1, 2, 3):
+        await rbac.verify(request, 'GET', f'/api/v1/users/{pk}', '/api/v1/users/{pk}')
+    assert lookups() == (hits + 2, misses + 1)
@@ -0,0 +1,77 @@
+import pytest
+
+from backend.database.db_redis import RedisCli
+
+INDEX, GENERATION = 'index:u', 'generation:u'
+ACCESS, REFRESH = 'access:u:', 'refresh:u:'
+
+
+@pytest.fixture
+async def tokens(redis: RedisCli) -> RedisCli:
+    """Two sessions of a user: a0 / r0 and a1 / r1"""
+    for session in ('0', '1'):
+        await redis.add_user_token(INDEX, f'{ACCESS}a{session}', f'a{session}', 60)
+        await redis.add_user_token(INDEX, f'{REFRESH}r{session}', f'r{session}', 600)
+    return redis
+
+
+async def rotate(redis: RedisCli, refresh: str, new: str, generation: int = 0, prefixes: bool = True) -> bool:
+    return await redis.rotate_user_tokens(
+        index_key=INDEX,
+        generation_key=GENERATION,
+        refresh_key=f'{REFRESH}{refresh}',
+        refresh_token=refresh,
+        generation=generation,
+        access_key=f'{ACCESS}a1',
+        new_access=(f'{ACCESS}a{new}', f'a{new}', 60),
+        new_refresh=(f'{REFRESH}r{new}', f'r{new}', 600),
+        delete_prefixes=[ACCESS, REFRESH] if prefixes else [],
+        revoke_channel='revoke',
+        revoke_message='u',
+    )
+
+
+async def test_rotation_replaces_every_session(tokens: RedisCli):
+    assert await rotate(tokens, 'r1', '2')
+    assert await tokens.zrange(INDEX, 0, -1) == [f'{ACCESS}a2', f'{REFRESH}r2']
+    assert await tokens.get(f'{REFRESH}r2') == 'r2'
+    for key in ('a0', 'a1'):
+        assert await tokens.get(f'{ACCESS}{key}') is None
+    for key in ('r0', 'r1'):
+        assert await tokens.get(f'{REFRESH}{key}') is None
+
+
+async def test_multi_login_rotation_keeps_the_other_sessions(tokens: RedisCli):
+    assert await rotate(tokens, 'r1', '2', prefixes=False)
+    assert set(await tokens.zrange(INDEX, 0, -1)) == {f'{ACCESS}a0', f'{REFRESH}r0', f'{ACCESS}a2', f'{REFRESH}r2'}
+
+
+async def test_refresh_token_is_single_use(tokens: RedisCli):
+    assert await rotate(tokens, 'r1', '2')
+    assert not await rotate(tokens, 'r1', '3')
+    assert await tokens.get(f'{ACCESS}a3') is None
+
+
+async def test_revoked_generation_is_refused(tokens: RedisCli):
+    await tokens.incr(GENERATION)
+    assert not await rotate(tokens, 'r1', '2')
+    assert await tokens.get(f'{REFRESH}r1') == 'r1'
+
+
+async def test_rotation_retries_when_the_index_changes(tokens: RedisCli, monkeypatch):
+    zrange = tokens.zrange
+    calls = []
+
+    async def racing_zrange(*args, **kwargs):
+        keys = await zrange(*args, **kwargs)
+        calls.append(keys)
+        if len(calls) == 1:
+            # Another login lands between listing the keys and running the script
+            await tokens.add_user_token(INDEX, f'{ACCESS}a9', 'a9', 60)
+        return keys
+
+    monkeypatch.setattr(tokens, 'zrange', racing_zrange)
+    assert await rotate(tokens, 'r1', '2')
+    assert len(calls) == 2
+    assert await tokens.get(f'{ACCESS}a9') is None
+    assert await zrange(INDEX, 0, -1) == [f'{ACCESS}a2', f'{REFRESH}r2']
@@ -0,0 +1,33 @@
+import asyncio
+import json
+
+from backend.core.conf import settings
+from backend.utils import request_parse
+from backend.utils.request_parse import parse_ip_info
+
+
+async def test_online_fills_are_bounded(redis, monkeypatch):
+    monkeypatch.setattr(settings, 'IP_LOCATION_PARSE', 'online')
+    monkeypatch.setattr(settings, 'IP_LOCATION_ONLINE_MAX_PENDING', 2)
+    resolvable = asyncio.Event()
+    lookups = []
+
+    async def get_location_online(ip: str, user_agent: str | None) -> dict:
+        lookups.append(ip)
+        await resolvable.wait()
+        return {'country': 'FR', 'regionName': 'IDF', 'city': 'Paris'}
+
+    monkeypatch.setattr(request_parse, 'get_location_online', get_location_online)
+    ips = ['10.0.0.1', '10.0.0.1', '10.0.0.2', '10.0.0.3']
+    # The requests never wait for the lookup
+    for ip in ips:
+        assert (await parse_ip_info(ip, None)).country is None
+    assert sorted(request_parse._location_fills) == ['10.0.0.1', '10.0.0.2']
+
+    resolvable.set()
+    await asyncio.gather(*request_parse._location_fills.values())
+    assert request_parse._location_fills == {}
+    assert lookups == ['10.0.0.1', '10.0.0.2']
+    assert json.loads(await redis.get(f'{settings.IP_LOCATION_REDIS_PREFIX}:10.0.0.1'))['city'] == 'Paris'
+    assert (await parse_ip_info('10.0.0.2', None)).city == 'Paris'
+    assert await redis.get(f'{settings.IP_LOCATION_REDIS_PREFIX}:10.0.0.3') is None
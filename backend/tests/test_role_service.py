@@ -0,0 +1,36 @@
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from backend.app.admin.service import role_service as role_service_module
+from backend.app.admin.service.role_service import role_service
+from backend.common.security.jwt import user_cache
+from backend.core.conf import settings
+from backend.models import Role, User
+
+
+async def test_delete_invalidates_the_role_holders(monkeypatch, redis, published, db_session: async_sessionmaker):
+    monkeypatch.setattr(role_service_module, 'async_db_session', db_session)
+    async with db_session.begin() as db:
+        role, other = Role(name='editor', remark=''), Role(name='viewer', remark='')
+        holders = [User(email=f'{i}@example.com', password='x', salt=None) for i in range(2)]
+        bystander = User(email='other@example.com', password='x', salt=None)
+        for user in holders:
+            user.roles.append(role)
+        bystander.roles.append(other)
+        db.add_all([role, other, *holders, bystander])
+    subs = [user.x_id for user in holders]
+    for sub in [*subs, bystander.x_id]:
+        await redis.set(f'{settings.JWT_USER_REDIS_PREFIX}:{sub}', '{}')
+        user_cache.set(sub, object())
+
+    await role_service.delete(pk=[role.id])
+
+    for sub in subs:
+        assert await redis.get(f'{settings.JWT_USER_REDIS_PREFIX}:{sub}') is None
+        assert user_cache.get(sub) is None
+    assert await redis.get(f'{settings.JWT_USER_REDIS_PREFIX}:{bystander.x_id}') is not None
+    assert user_cache.get(bystander.x_id) is not None
+    assert len(published) == 1
+    channel, message = published[0]
+    assert channel == settings.JWT_USER_INVALIDATE_CHANNEL
+    assert sorted(message.split(',')) == sorted(subs)
+    user_cache.clear()
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from backend.utils.single_flight import SingleFlight
+
+
+class _Call:
+    def __init__(self, result: str = 'user', error: Exception | None = None):
+        self.result = result
+        self.error = error
+        self.calls = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self) -> str:
+        self.calls += 1
+        await self.release.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+async def _started(*tasks: asyncio.Task) -> None:
+    # Let every caller reach its wait on the shared call
+    for _ in range(len(tasks) + 1):
+        await asyncio.sleep(0)
+
+
+async def test_concurrent_callers_share_one_result():
+    flight: SingleFlight[str] = SingleFlight()
+    call = _Call()
+    tasks = [asyncio.create_task(flight.do('sub', call)) for _ in range(3)]
+    await _started(*tasks)
+    call.release.set()
+    assert await asyncio.gather(*tasks) == ['user'] * 3
+    assert call.calls == 1
+    # The key is released once the call is done
+    call.release.clear()
+    task = asyncio.create_task(flight.do('sub', call))
+    await _started(task)
+    call.release.set()
+    assert await task == 'user'
+    assert call.calls == 2
+
+
+async def test_concurrent_callers_share_one_exception():
+    flight: SingleFlight[str] = SingleFlight()
+    call = _Call(error=ValueError('db down'))
+    tasks = [asyncio.create_task(flight.do('sub', call)) for _ in range(3)]
+    await _started(*tasks)
+    call.release.set()
+    results = await asyncio.gather(*tasks, return_exceptions=True)
+    assert [type(result) for result in results] == [ValueError] * 3
+    assert call.calls == 1
+
+
+async def test_cancelled_leader_leaves_the_call_to_the_waiters():
+    flight: SingleFlight[str] = SingleFlight()
+    call = _Call()
+    leader = asyncio.create_task(flight.do('sub', call))
+    await _started(leader)
+    waiter = asyncio.create_task(flight.do('sub', call))
+    await _started(waiter)
+
+    leader.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await leader
+    call.release.set()
+    assert await waiter == 'user'
+    assert call.calls == 1
@@ -0,0 +1,74 @@
+import time
+
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, TypeVar
+
+K = TypeVar('K', bound=Hashable)
+V = TypeVar('V')
+
+
+class LRUCache(Generic[K, V]):
+    """Bounded in-process LRU cache with an optional per-entry TTL and hit/miss counters"""
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        """
+        :param maxsize: Maximum number of entries, the least recently used one is evicted first
+        :param ttl: Default time to live in seconds, None to keep entries until evicted
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data: OrderedDict[K, tuple[V, float | None]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get(self, key: K, default: Any = None) -> V | Any:
+        """
+        Get a value, counting a hit or a miss
+
+        :param key:
+        :param default:
+        :return:
+        """
+        item = self._data.get(key)
+        if item is not None:
+            value, expire = item
+            if expire is None or expire > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return value
+            del self._data[key]
+        self.misses += 1
+        return default
+
+    def set(self, key: K, value: V, ttl: float | None = None) -> None:
+        """
+        Set a value
+
+        :param key:
+        :param value:
+        :param ttl: Override the default time to live
+        :return:
+        """
+        ttl = self.ttl if ttl is None else ttl
+        self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: K, default: Any = None) -> V | Any:
+        item = self._data.pop(key, None)
+        return default if item is None else item[0]
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def items(self) -> list[tuple[K, V]]:
+        return [(k, v) for k, (v, _) in self._data.items()]
+
+    @property
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
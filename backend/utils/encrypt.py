@@ -1,6 +1,6 @@
 import os
 
-from typing import Any
+from typing import Any, Callable
 
 from cryptography.hazmat.backends.openssl import backend
 from cryptography.hazmat.primitives import padding
@@ -106,3 +106,19 @@ class ItsDCipher:
             log.error(f'ItsDangerous decrypt failed: {e}')
             plaintext = ciphertext
         return plaintext
+
+
+def desensitize(data: Any, keys: frozenset[str], mask: Callable[[Any], Any]) -> Any:
+    """
+    Replace the values of the given keys, recursing into nested dicts and lists
+
+    :param data:
+    :param keys: Keys whose values are sensitive
+    :param mask: Applied to each sensitive value
+    :return: A desensitized copy of the data
+    """
+    if isinstance(data, dict):
+        return {k: mask(v) if k in keys else desensitize(v, keys, mask) for k, v in data.items()}
+    if isinstance(data, list):
+        return [desensitize(v, keys, mask) for v in data]
+    return data
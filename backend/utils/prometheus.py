@@ -14,13 +14,11 @@ from opentelemetry.sdk.trace.export import BatchSpanProcessor
 from prometheus_client import REGISTRY, Counter, Gauge, Histogram
 from prometheus_client.openmetrics.exposition import (CONTENT_TYPE_LATEST,
                                                       generate_latest)
-from starlette.middleware.base import (BaseHTTPMiddleware,
-                                       RequestResponseEndpoint)
 from starlette.requests import Request
 from starlette.responses import Response
 from starlette.routing import Match
 from starlette.status import HTTP_500_INTERNAL_SERVER_ERROR
-from starlette.types import ASGIApp
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 INFO = Gauge(
     "fastapi_app_info", "FastAPI application information.", [
@@ -50,34 +48,81 @@ REQUESTS_IN_PROGRESS = Gauge(
     "Gauge of requests by method and path currently being processed",
     ["method", "path", "app_name"],
 )
+PASSWORD_HASH_QUEUED = Gauge(
+    "password_hash_queued",
+    "Gauge of password hash operations waiting for an executor slot",
+    ["operation"],
+)
+PASSWORD_HASH_IN_PROGRESS = Gauge(
+    "password_hash_in_progress",
+    "Gauge of password hash operations currently running on the executor",
+    ["operation"],
+)
+PASSWORD_HASH_DURATION = Histogram(
+    "password_hash_duration_seconds",
+    "Histogram of password hash operation time on the executor (in seconds)",
+    ["operation"],
+)
+OPERA_LOG_RECORDS = Counter(
+    "opera_log_records_total",
+    "Total count of operation log records by outcome (written, dropped_full, dropped_error)",
+    ["result"],
+)
+OPERA_LOG_QUEUE_SIZE = Gauge(
+    "opera_log_queue_size",
+    "Gauge of operation log records waiting to be written",
+)
+USER_AGENT_CACHE = Counter(
+    "user_agent_cache_total",
+    "Total count of user agent parse cache lookups by result (hit or miss)",
+    ["result"],
+)
+RBAC_DECISION_CACHE = Counter(
+    "rbac_decision_cache_total",
+    "Total count of RBAC decision cache lookups by result (hit or miss)",
+    ["result"],
+)
 
 
-class PrometheusMiddleware(BaseHTTPMiddleware):
+class PrometheusMiddleware:
     def __init__(self, app: ASGIApp, app_name: str = "fastapi-app") -> None:
-        super().__init__(app)
+        self.app = app
         self.app_name = app_name
         INFO.labels(app_name=self.app_name).inc()
 
-    async def dispatch(self, request: Request, call_next: RequestResponseEndpoint) -> Response:
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request = Request(scope)
         method = request.method
         path, is_handled_path = self.get_path(request)
 
         if not is_handled_path:
-            return await call_next(request)
+            await self.app(scope, receive, send)
+            return
+
+        status_code = HTTP_500_INTERNAL_SERVER_ERROR
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
 
         REQUESTS_IN_PROGRESS.labels(
             method=method, path=path, app_name=self.app_name).inc()
         REQUESTS.labels(method=method, path=path, app_name=self.app_name).inc()
         before_time = time.perf_counter()
         try:
-            response = await call_next(request)
+            await self.app(scope, receive, send_wrapper)
         except BaseException as e:
             status_code = HTTP_500_INTERNAL_SERVER_ERROR
             EXCEPTIONS.labels(method=method, path=path, exception_type=type(
                 e).__name__, app_name=self.app_name).inc()
             raise e from None
         else:
-            status_code = response.status_code
             after_time = time.perf_counter()
             # retrieve trace id for exemplar
             span = trace.get_current_span()
@@ -93,8 +138,6 @@ class PrometheusMiddleware(BaseHTTPMiddleware):
             REQUESTS_IN_PROGRESS.labels(
                 method=method, path=path, app_name=self.app_name).dec()
 
-        return response
-
     @staticmethod
     def get_path(request: Request) -> Tuple[str, bool]:
         for route in request.app.routes:
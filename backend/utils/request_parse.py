@@ -1,7 +1,8 @@
+import asyncio
 import httpx
 import json 
+import mmap
 
-from asgiref.sync import sync_to_async
 from fastapi import Request
 from user_agents import parse
 from XdbSearchIP.xdbSearcher import XdbSearcher
@@ -11,6 +12,20 @@ from backend.common.log import log
 from backend.core.conf import settings
 from backend.core.path_conf import IP2REGION_XDB
 from backend.database.db_redis import redis_client
+from backend.utils.cache import LRUCache
+from backend.utils.prometheus import USER_AGENT_CACHE
+
+_xdb_searcher: XdbSearcher | None = None
+_http_client: httpx.AsyncClient | None = None
+
+# Ips being resolved online, to start a single background fill per ip, at most IP_LOCATION_ONLINE_MAX_PENDING
+_location_fills: dict[str, asyncio.Task] = {}
+
+# Ip -> offline location, in front of the xdb searcher for the hottest ips
+_offline_location_cache: LRUCache[str, dict | None] = LRUCache(settings.IP_LOCATION_CACHE_MAXSIZE)
+
+# Raw user agent -> (os, browser, device), clients send few distinct user agents
+_user_agent_cache: LRUCache[str | None, tuple[str, str, str]] = LRUCache(settings.USER_AGENT_CACHE_MAXSIZE)
 
 
 def get_request_ip(request: Request) -> str:
@@ -37,19 +52,91 @@ async def get_location_online(ip: str, user_agent: str) -> dict | None:
     :param user_agent:
     :return:
     """
-    async with httpx.AsyncClient(timeout=3) as client:
-        ip_api_url = f'http://ip-api.com/json/{ip}?lang=fr-FR'
-        headers = {'User-Agent': user_agent}
-        try:
-            response = await client.get(ip_api_url, headers=headers)
-            if response.status_code == 200:
-                return response.json()
-        except Exception as e:
-            log.error(f'Failed to obtain ip address attributes online, error message:{e}')
-            return None
-
-
-@sync_to_async
+    ip_api_url = settings.IP_LOCATION_ONLINE_URL.format(ip=ip)
+    headers = {'User-Agent': user_agent} if user_agent else None
+    try:
+        response = await get_http_client().get(ip_api_url, headers=headers)
+        if response.status_code == 200:
+            data = response.json()
+            # ip-api answers 200 with status 'fail' for private or reserved ranges
+            if data.get('status') != 'fail':
+                return data
+    except Exception as e:
+        log.error(f'Failed to obtain ip address attributes online, error message:{e}')
+    return None
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the pooled client used for online ip lookups
+
+    :return:
+    """
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            timeout=settings.IP_LOCATION_ONLINE_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.IP_LOCATION_ONLINE_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.IP_LOCATION_ONLINE_MAX_CONNECTIONS,
+            ),
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """
+    Close the pooled client and wait for the pending location fills
+
+    :return:
+    """
+    global _http_client
+    if _location_fills:
+        await asyncio.gather(*_location_fills.values(), return_exceptions=True)
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+async def _fill_location_online(ip: str, user_agent: str | None) -> None:
+    try:
+        location_info = await get_location_online(ip, user_agent)
+        if location_info:
+            location = {
+                'country': location_info.get('country'),
+                'region': location_info.get('regionName'),
+                'city': location_info.get('city'),
+            }
+            expire_seconds = settings.IP_LOCATION_EXPIRE_SECONDS
+        else:
+            # Negative cache, an unreachable api is not retried on every request
+            location = {'country': None, 'region': None, 'city': None}
+            expire_seconds = settings.IP_LOCATION_FAILURE_EXPIRE_SECONDS
+        await redis_client.set(
+            f'{settings.IP_LOCATION_REDIS_PREFIX}:{ip}', json.dumps(location), ex=expire_seconds
+        )
+    except Exception as e:
+        log.error(f'Failed to cache ip address attributes, error message:{e}')
+    finally:
+        _location_fills.pop(ip, None)
+
+
+def get_xdb_searcher() -> XdbSearcher:
+    """
+    Get the process wide ip2region searcher, created once over a read-only mmap of the xdb file
+
+    The mapping is backed by the page cache, so every worker shares the same physical pages
+
+    :return:
+    """
+    global _xdb_searcher
+    if _xdb_searcher is None:
+        with open(IP2REGION_XDB, 'rb') as f:
+            content = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        _xdb_searcher = XdbSearcher(contentBuff=content)
+    return _xdb_searcher
+
+
 def get_location_offline(ip: str) -> dict | None:
     """
     Get ip address generically offline, can't guarantee accuracy, 100% available
@@ -57,25 +144,34 @@ def get_location_offline(ip: str) -> dict | None:
     :param ip:
     :return:
     """
+    location = _offline_location_cache.get(ip, False)
+    if location is not False:
+        return location
     try:
-        cb = XdbSearcher.loadContentFromFile(dbfile=IP2REGION_XDB)
-        searcher = XdbSearcher(contentBuff=cb)
-        data = searcher.search(ip)
-        searcher.close()
+        data = get_xdb_searcher().search(ip)
         data = data.split('|')
-        return {
+        location = {
             'country': data[0] if data[0] != '0' else None,
             'regionName': data[2] if data[2] != '0' else None,
             'city': data[3] if data[3] != '0' else None,
         }
     except Exception as e:
         log.error(f'Failed to obtain ip address generics offline, error message:{e}')
-        return None
+        location = None
+    _offline_location_cache.set(ip, location)
+    return location
 
 
-async def parse_ip_info(request: Request) -> IpInfo:
+async def parse_ip_info(ip: str, user_agent: str | None) -> IpInfo:
     country, region, city = None, None, None
-    ip = get_request_ip(request)
+    if settings.IP_LOCATION_PARSE == 'offline':
+        # The in-process lookup is cheaper than a redis round trip
+        location_info = get_location_offline(ip)
+        if location_info:
+            country = location_info.get('country')
+            region = location_info.get('regionName')
+            city = location_info.get('city')
+        return IpInfo(ip=ip, country=country, region=region, city=city)
     location = await redis_client.get(f'{settings.IP_LOCATION_REDIS_PREFIX}:{ip}')
     if location:
         location = json.loads(location)
@@ -83,28 +179,50 @@ async def parse_ip_info(request: Request) -> IpInfo:
         region = location.get("region")
         city = location.get("city")
         return IpInfo(ip=ip, country=country, region=region, city=city)
-    if settings.IP_LOCATION_PARSE == 'online':
-        location_info = await get_location_online(ip, request.headers.get('User-Agent'))
-    elif settings.IP_LOCATION_PARSE == 'offline':
-        location_info = await get_location_offline(ip)
-    else:
-        location_info = None
-    if location_info:
-        country = location_info.get('country')
-        region = location_info.get('regionName')
-        city = location_info.get('city')
-        await redis_client.set(
-            f'{settings.IP_LOCATION_REDIS_PREFIX}:{ip}',
-            json.dumps({"country": country, "region": region, "city": city}),
-            ex=settings.IP_LOCATION_EXPIRE_SECONDS,
-        )
+    if settings.IP_LOCATION_PARSE == 'online' and ip not in _location_fills:
+        # Resolved off the request path, this request proceeds with an empty location;
+        # when too many lookups are in flight the fill is dropped and left to a later request
+        if len(_location_fills) < settings.IP_LOCATION_ONLINE_MAX_PENDING:
+            _location_fills[ip] = asyncio.create_task(_fill_location_online(ip, user_agent))
     return IpInfo(ip=ip, country=country, region=region, city=city)
 
 
-def parse_user_agent_info(request: Request) -> UserAgentInfo:
-    user_agent = request.headers.get('User-Agent')
-    _user_agent = parse(user_agent)
-    os = _user_agent.get_os()
-    browser = _user_agent.get_browser()
-    device = _user_agent.get_device()
+def parse_user_agent_info(user_agent: str | None) -> UserAgentInfo:
+    parsed = _user_agent_cache.get(user_agent)
+    if parsed is None:
+        USER_AGENT_CACHE.labels(result='miss').inc()
+        _user_agent = parse(user_agent)
+        parsed = (_user_agent.get_os(), _user_agent.get_browser(), _user_agent.get_device())
+        _user_agent_cache.set(user_agent, parsed)
+    else:
+        USER_AGENT_CACHE.labels(result='hit').inc()
+    os, browser, device = parsed
     return UserAgentInfo(user_agent=user_agent, device=device, os=os, browser=browser)
+
+
+class RequestContext:
+    """Client information of a request, geolocation and user agent are only resolved on first access"""
+
+    __slots__ = ('ip', 'user_agent', '_ip_info', '_ua_info')
+
+    def __init__(self, request: Request):
+        self.ip = get_request_ip(request)
+        self.user_agent = request.headers.get('User-Agent')
+        self._ip_info: IpInfo | None = None
+        self._ua_info: UserAgentInfo | None = None
+
+    async def ip_info(self) -> IpInfo:
+        """
+        Resolve the ip location, at most once per request
+
+        :return:
+        """
+        if self._ip_info is None:
+            self._ip_info = await parse_ip_info(self.ip, self.user_agent)
+        return self._ip_info
+
+    @property
+    def ua_info(self) -> UserAgentInfo:
+        if self._ua_info is None:
+            self._ua_info = parse_user_agent_info(self.user_agent)
+        return self._ua_info
@@ -0,0 +1,37 @@
+import asyncio
+
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar('T')
+
+
+class SingleFlight(Generic[T]):
+    """Coalesce concurrent calls for the same key into a single in-flight call"""
+
+    def __init__(self):
+        self._calls: dict[Hashable, asyncio.Task[T]] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run fn, or wait for the call already running for this key
+
+        The call runs in its own task, so a cancelled caller (the first one included) only
+        stops waiting and the others still get its result
+
+        :param key:
+        :param fn:
+        :return: The result (or exception) shared by every caller of the key
+        """
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return await asyncio.shield(task)
+
+    def _done(self, key: Hashable, task: asyncio.Task[T]) -> None:
+        if self._calls.get(key) is task:
+            del self._calls[key]
+        # Mark as retrieved, every caller may have stopped waiting
+        if not task.cancelled():
+            task.exception()